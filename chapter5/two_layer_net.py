@@ -4,6 +4,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
 import numpy as np
 from common.layers import *
 from common.gradient import numerical_gradient
+from common.config import get_default_dtype
 from collections import OrderedDict
 
 # 定义一个两层神经网络的类
@@ -11,23 +12,26 @@ class TwoLayerNet:
 
     # 构造函数，初始化网络参数和层
     def __init__(self, input_size, hidden_size, output_size, weight_init_std = 0.01):
-        # 初始化权重
+        # 初始化权重（使用common.config设定的dtype）
+        self.dtype = get_default_dtype()
         self.params = {}
-        self.params['W1'] = weight_init_std * np.random.randn(input_size, hidden_size)
-        self.params['b1'] = np.zeros(hidden_size)
-        self.params['W2'] = weight_init_std * np.random.randn(hidden_size, output_size) 
-        self.params['b2'] = np.zeros(output_size)
+        self.params['W1'] = (weight_init_std * np.random.randn(input_size, hidden_size)).astype(self.dtype)
+        self.params['b1'] = np.zeros(hidden_size, dtype=self.dtype)
+        self.params['W2'] = (weight_init_std * np.random.randn(hidden_size, output_size)).astype(self.dtype)
+        self.params['b2'] = np.zeros(output_size, dtype=self.dtype)
 
         # 生成层
         self.layers = OrderedDict()
         self.layers['Affine1'] = Affine(self.params['W1'], self.params['b1'])
-        self.layers['Relu1'] = Relu()
+        self.layers['Relu1'] = Relu(inplace=True)  # Affine1的输出不再被使用，原地计算
         self.layers['Affine2'] = Affine(self.params['W2'], self.params['b2'])
 
         self.lastLayer = SoftmaxWithLoss()
+        self.layers['Affine1'].need_dx = False  # 对输入数据的梯度不需要
         
     # 预测函数，输入数据x并返回预测结果
     def predict(self, x):
+        x = x.astype(self.dtype, copy=False)
         for layer in self.layers.values():
             x = layer.forward(x)
         
@@ -0,0 +1,124 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from common.layers import BatchNormalization
+from common.multi_layer_net_extend import MultiLayerNetExtend
+
+
+class BatchNormalizationRef:
+    """修改前的BatchNormalization（逐步生成xc、xc**2、std、xn等临时数组），作为比较的基准"""
+    def __init__(self, gamma, beta, momentum=0.9, running_mean=None, running_var=None):
+        self.gamma = gamma
+        self.beta = beta
+        self.momentum = momentum
+        self.input_shape = None
+        self.running_mean = running_mean
+        self.running_var = running_var
+        self.batch_size = None
+        self.xc = None
+        self.std = None
+        self.dgamma = None
+        self.dbeta = None
+
+    def forward(self, x, train_flg=True):
+        self.input_shape = x.shape
+        if x.ndim != 2:
+            x = x.reshape(x.shape[0], -1)
+        out = self.__forward(x, train_flg)
+        return out.reshape(*self.input_shape)
+
+    def __forward(self, x, train_flg):
+        if self.running_mean is None:
+            N, D = x.shape
+            self.running_mean = np.zeros(D)
+            self.running_var = np.zeros(D)
+        if train_flg:
+            mu = x.mean(axis=0)
+            xc = x - mu
+            var = np.mean(xc**2, axis=0)
+            std = np.sqrt(var + 10e-7)
+            xn = xc / std
+            self.batch_size = x.shape[0]
+            self.xc = xc
+            self.xn = xn
+            self.std = std
+            self.running_mean = self.momentum * self.running_mean + (1-self.momentum) * mu
+            self.running_var = self.momentum * self.running_var + (1-self.momentum) * var
+        else:
+            xc = x - self.running_mean
+            xn = xc / ((np.sqrt(self.running_var + 10e-7)))
+        out = self.gamma * xn + self.beta
+        return out
+
+    def backward(self, dout):
+        if dout.ndim != 2:
+            dout = dout.reshape(dout.shape[0], -1)
+        dx = self.__backward(dout)
+        dx = dx.reshape(*self.input_shape)
+        return dx
+
+    def __backward(self, dout):
+        dbeta = dout.sum(axis=0)
+        dgamma = np.sum(self.xn * dout, axis=0)
+        dxn = self.gamma * dout
+        dxc = dxn / self.std
+        dstd = -np.sum((dxn * self.xc) / (self.std * self.std), axis=0)
+        dvar = 0.5 * dstd / self.std
+        dxc += (2.0 / self.batch_size) * self.xc * dvar
+        dmu = np.sum(dxc, axis=0)
+        dx = dxc - dmu / self.batch_size
+        self.dgamma = dgamma
+        self.dbeta = dbeta
+        return dx
+
+
+def bench(f, repeat):
+    f()  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+# 1. 单层：batch_norm_test.py 中的 (batch_size, hidden) = (100, 100)，以及更大的形状
+print("== layer (forward + backward)")
+print("%-14s %-8s %12s %12s %8s %10s %10s" % ("shape", "dtype", "ref(us)", "fused(us)", "speedup",
+                                            "max|dx|", "cache"))
+for shape in ((100, 100), (100, 1000), (1000, 1000)):
+    x = np.random.randn(*shape) * 3 + 1
+    dout = np.random.randn(*shape)
+    gamma, beta = np.random.rand(shape[1]) + 0.5, np.random.randn(shape[1])
+    repeat = max(10, 2000000 // x.size)
+    ref = BatchNormalizationRef(gamma, beta)
+    t_ref = bench(lambda: ref.backward(ref.forward(x)), repeat)
+    dx_ref = ref.backward(dout)
+    ref_bytes = ref.xc.nbytes + ref.xn.nbytes + ref.std.nbytes
+    for dtype in (np.float64, np.float32):
+        bn = BatchNormalization(gamma, beta, dtype=dtype)
+        t_new = bench(lambda: bn.backward(bn.forward(x)), repeat)
+        bn.forward(x)
+        err = np.abs(bn.backward(dout) - dx_ref).max()
+        new_bytes = bn.xn.nbytes + bn.inv_std.nbytes
+        print("%-14s %-8s %12.1f %12.1f %7.2fx %10.1e %9.2fx" % (str(shape), np.dtype(dtype).name, t_ref,
+                                                               t_new, t_ref / t_new, err,
+                                                               ref_bytes / new_bytes))
+
+# 2. batch_norm_test.py 的网络：MultiLayerNetExtend(784, [100]*5, 10)、batch_size=100
+print("== MultiLayerNetExtend gradient (batch_size=100)")
+x = np.random.rand(100, 784)
+t = np.random.randint(0, 10, 100)
+times = {}
+for name in ('ref', 'fused'):
+    np.random.seed(0)
+    network = MultiLayerNetExtend(input_size=784, hidden_size_list=[100, 100, 100, 100, 100], output_size=10,
+                                  weight_init_std=0.01, use_batchnorm=True)
+    if name == 'ref':
+        for key, layer in network.layers.items():
+            if isinstance(layer, BatchNormalization):
+                network.layers[key] = BatchNormalizationRef(layer.gamma, layer.beta)
+    times[name] = bench(lambda: network.gradient(x, t), 200)
+    print("%-6s %10.1f us" % (name, times[name]))
+print("speedup: %.2fx" % (times['ref'] / times['fused']))
@@ -0,0 +1,55 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from common.multi_layer_net import MultiLayerNet
+from common.checkpoint import cache_nbytes
+
+# 比较MultiLayerNet的隐藏层使用 Affine -> Relu/Sigmoid（默认）与 AffineActivation（fuse_activation=True）时
+# 每次迭代（gradient）、推理（predict）的时间和为反向传播缓存的数据的大小，并确认梯度相同
+batch_size = 100
+repeat = 10
+hidden_size_lists = [[100] * 5, [500] * 3, [1000] * 2]
+x = np.random.rand(batch_size, 784)
+t = np.random.randint(0, 10, batch_size)
+
+
+def bench(func):
+    func()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+print("batch_size: " + str(batch_size))
+print("%-8s %-16s %14s %14s %14s %14s %10s" % ("act", "hidden", "gradient(ms)", "fused(ms)",
+                                                "predict(ms)", "fused(ms)", "identical"))
+for activation in ('relu', 'sigmoid'):
+    for hidden_size_list in hidden_size_lists:
+        row, grads = [], []
+        for fuse in (False, True):
+            np.random.seed(0)
+            network = MultiLayerNet(784, hidden_size_list, 10, activation=activation, fuse_activation=fuse)
+            row.append((bench(lambda: network.gradient(x, t)), bench(lambda: network.predict(x))))
+            grads.append({k: v.copy() for k, v in network.gradient(x, t).items()})
+        identical = all(np.array_equal(grads[0][k], grads[1][k]) for k in grads[0])
+        print("%-8s %-16s %14.3f %14.3f %14.3f %14.3f %10s" % (
+            activation, "%dx%d" % (len(hidden_size_list), hidden_size_list[0]),
+            row[0][0] * 1e3, row[1][0] * 1e3, row[0][1] * 1e3, row[1][1] * 1e3, identical))
+
+# 前向传播后各层缓存的数据（Relu的掩码、Sigmoid的输出、Affine的输入等）
+print("\n%-8s %-16s %14s %14s" % ("act", "hidden", "cache(KB)", "fused(KB)"))
+for activation in ('relu', 'sigmoid'):
+    for hidden_size_list in hidden_size_lists:
+        sizes = []
+        for fuse in (False, True):
+            network = MultiLayerNet(784, hidden_size_list, 10, activation=activation, fuse_activation=fuse)
+            network.loss(x, t)
+            sizes.append(cache_nbytes(list(network.layers.values())))
+        print("%-8s %-16s %14.1f %14.1f" % (activation, "%dx%d" % (len(hidden_size_list), hidden_size_list[0]),
+                                          sizes[0] / 1024, sizes[1] / 1024))
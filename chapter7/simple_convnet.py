@@ -7,6 +7,8 @@ import numpy as np
 from collections import OrderedDict
 from common.layers import *
 from common.gradient import numerical_gradient
+from common.checkpoint import checkpoint_gradient
+from common.config import get_default_dtype
 
 
 class SimpleConvNet:
@@ -23,10 +25,27 @@ class SimpleConvNet:
     weight_init_std : 指定权重的标准差（e.g. 0.01）
         指定'relu'或'he'的情况下设定“He的初始值”
         指定'sigmoid'或'xavier'的情况下设定“Xavier的初始值”
+    checkpoint_segments : 激活值检查点的分段策略（None表示不使用，参见common/checkpoint.py）
+    layout : 卷积部分的数据排列，'NCHW'（默认）或 'NHWC'
+        NHWC时只在输入处和全连接层之前各转置一次，输入数据和参数的形状与NCHW时相同
+    fuse_conv_relu_pool : 为True时把 conv - relu - pool 换成融合层ConvReluPool
+        （层名仍为'Conv1'，不保留卷积的输出和ReLU的掩码）
+    num_workers : 卷积层的线程数（默认1，参见common/layers.Convolution）
+    parallel_backward : 为True时各层反向传播的dx和dW同时计算（参见common/layers.Affine、Convolution）
+    use_batchnorm : 为True时在Conv1之后插入按通道归一化的BatchNormalization（spatial=True，层名'BatchNorm1'，
+        参数为 gamma1、beta1，形状 (filter_num,)），即 conv - bn - relu - pool；不能与fuse_conv_relu_pool同时使用
+    global_pool : 为True时池化层之后接全局平均池化（GlobalAvgPooling，层名'GlobalPool'），
+        W2的形状从 (filter_num*池化后的高*宽, hidden_size) 变为 (filter_num, hidden_size)
+
+    参数和输入使用生成时的 common.config.get_default_dtype()（self.dtype）
     """
     def __init__(self, input_dim=(1, 28, 28), 
                  conv_param={'filter_num':30, 'filter_size':5, 'pad':0, 'stride':1},
-                 hidden_size=100, output_size=10, weight_init_std=0.01):
+                 hidden_size=100, output_size=10, weight_init_std=0.01, checkpoint_segments=None,
+                 layout='NCHW', fuse_conv_relu_pool=False, num_workers=1, parallel_backward=False,
+                 use_batchnorm=False, global_pool=False):
+        if use_batchnorm and fuse_conv_relu_pool:
+            raise ValueError("use_batchnorm cannot be combined with fuse_conv_relu_pool")
         filter_num = conv_param['filter_num']
         filter_size = conv_param['filter_size']
         filter_pad = conv_param['pad']
@@ -34,42 +53,85 @@ class SimpleConvNet:
         input_size = input_dim[1]
         conv_output_size = (input_size - filter_size + 2*filter_pad) / filter_stride + 1
         pool_output_size = int(filter_num * (conv_output_size/2) * (conv_output_size/2))
+        if global_pool:
+            pool_output_size = filter_num  # 每个通道只剩一个平均值
 
         # 初始化权重
+        self.dtype = get_default_dtype()
         self.params = {}
-        self.params['W1'] = weight_init_std * \
-                            np.random.randn(filter_num, input_dim[0], filter_size, filter_size)
-        self.params['b1'] = np.zeros(filter_num)
-        self.params['W2'] = weight_init_std * \
-                            np.random.randn(pool_output_size, hidden_size)
-        self.params['b2'] = np.zeros(hidden_size)
-        self.params['W3'] = weight_init_std * \
-                            np.random.randn(hidden_size, output_size)
-        self.params['b3'] = np.zeros(output_size)
+        self.params['W1'] = (weight_init_std * \
+                             np.random.randn(filter_num, input_dim[0], filter_size, filter_size)).astype(self.dtype)
+        self.params['b1'] = np.zeros(filter_num, dtype=self.dtype)
+        self.params['W2'] = (weight_init_std * \
+                             np.random.randn(pool_output_size, hidden_size)).astype(self.dtype)
+        self.params['b2'] = np.zeros(hidden_size, dtype=self.dtype)
+        self.params['W3'] = (weight_init_std * \
+                             np.random.randn(hidden_size, output_size)).astype(self.dtype)
+        self.params['b3'] = np.zeros(output_size, dtype=self.dtype)
+        self.use_batchnorm = use_batchnorm
+        if use_batchnorm:
+            self.params['gamma1'] = np.ones(filter_num, dtype=self.dtype)
+            self.params['beta1'] = np.zeros(filter_num, dtype=self.dtype)
 
         # 生成层
         self.layers = OrderedDict()
-        self.layers['Conv1'] = Convolution(self.params['W1'], self.params['b1'],
-                                           conv_param['stride'], conv_param['pad'])
-        self.layers['Relu1'] = Relu()
-        self.layers['Pool1'] = Pooling(pool_h=2, pool_w=2, stride=2)
-        self.layers['Affine1'] = Affine(self.params['W2'], self.params['b2'])
-        self.layers['Relu2'] = Relu()
-        self.layers['Affine2'] = Affine(self.params['W3'], self.params['b3'])
+        if layout == 'NHWC':
+            self.layers['ToNHWC'] = Transpose((0, 2, 3, 1))
+        if fuse_conv_relu_pool:
+            self.layers['Conv1'] = ConvReluPool(self.params['W1'], self.params['b1'],
+                                                conv_param['stride'], conv_param['pad'],
+                                                pool_size=2, layout=layout, num_workers=num_workers,
+                                                parallel_backward=parallel_backward)
+        else:
+            self.layers['Conv1'] = Convolution(self.params['W1'], self.params['b1'],
+                                               conv_param['stride'], conv_param['pad'], layout=layout,
+                                               num_workers=num_workers, parallel_backward=parallel_backward)
+            if use_batchnorm:
+                self.layers['BatchNorm1'] = BatchNormalization(self.params['gamma1'], self.params['beta1'],
+                                                               layout=layout, spatial=True)
+            self.layers['Relu1'] = Relu(inplace=True)  # Conv1、Affine1的输出不再被使用，原地计算
+            self.layers['Pool1'] = Pooling(pool_h=2, pool_w=2, stride=2, layout=layout)
+        if global_pool:
+            self.layers['GlobalPool'] = GlobalAvgPooling(layout)  # 输出 (N, filter_num)，不需要转换回NCHW
+        elif layout == 'NHWC':
+            self.layers['ToNCHW'] = Transpose((0, 3, 1, 2))
+        self.layers['Affine1'] = Affine(self.params['W2'], self.params['b2'], parallel_backward)
+        self.layers['Relu2'] = Relu(inplace=True)
+        self.layers['Affine2'] = Affine(self.params['W3'], self.params['b3'], parallel_backward)
 
         self.last_layer = SoftmaxWithLoss()
+        self.checkpoint_segments = checkpoint_segments
 
-    def predict(self, x):
-        for layer in self.layers.values():
-            x = layer.forward(x)
+        # 反向传播到Conv1为止，对输入图像的梯度不再计算（参见freeze_prefix）
+        self.frozen = 0
+        self.backward_start = backward_start(list(self.layers.values()))
+
+    def freeze_prefix(self, n):
+        """冻结前n个有参数的层（Conv1、BatchNorm1（use_batchnorm时）、Affine1、Affine2）
+
+        gradient()不再计算被冻结的层的梯度，返回的dict中也不包含它们的参数（优化器只更新dict中的参数）。
+        反向传播到第一个没有被冻结的有参数的层为止，该层的输入梯度（dx）也不计算。n=0时解除冻结。
+        被冻结的BatchNormalization层学习时也使用移动平均归一化，不再更新running_mean、running_var。
+        """
+        self.frozen = n
+        self.backward_start = backward_start(list(self.layers.values()), n)
+
+    def predict(self, x, train_flg=False):
+        x = x.astype(self.dtype, copy=False)
+        for key, layer in self.layers.items():
+            if "BatchNorm" in key:
+                x = layer.forward(x, train_flg)
+            else:
+                x = layer.forward(x)
 
         return x
 
-    def loss(self, x, t):
+    def loss(self, x, t, train_flg=True):
         """求损失函数
         参数x是输入数据、t是教师标签
+        与DeepConvNet相同，默认是学习时的损失（Trainer不传train_flg），BatchNormalization使用mini-batch的统计量
         """
-        y = self.predict(x)
+        y = self.predict(x, train_flg)
         return self.last_layer.forward(y, t)
 
     def accuracy(self, x, t, batch_size=100):
@@ -80,7 +142,7 @@ class SimpleConvNet:
         for i in range(int(x.shape[0] / batch_size)):
             tx = x[i*batch_size:(i+1)*batch_size]
             tt = t[i*batch_size:(i+1)*batch_size]
-            y = self.predict(tx)
+            y = self.predict(tx, train_flg=False)
             y = np.argmax(y, axis=1)
             acc += np.sum(y == tt) 
         
@@ -99,13 +161,17 @@ class SimpleConvNet:
         具有各层的梯度的字典变量
             grads['W1']、grads['W2']、...是各层的权重
             grads['b1']、grads['b2']、...是各层的偏置
+            grads['gamma1']、grads['beta1']是BatchNorm1的参数（use_batchnorm时）
         """
-        loss_w = lambda w: self.loss(x, t)
+        loss_w = lambda w: self.loss(x, t, train_flg=True)
 
         grads = {}
         for idx in (1, 2, 3):
             grads['W' + str(idx)] = numerical_gradient(loss_w, self.params['W' + str(idx)])
             grads['b' + str(idx)] = numerical_gradient(loss_w, self.params['b' + str(idx)])
+        if self.use_batchnorm:
+            grads['gamma1'] = numerical_gradient(loss_w, self.params['gamma1'])
+            grads['beta1'] = numerical_gradient(loss_w, self.params['beta1'])
 
         return grads
 
@@ -122,24 +188,34 @@ class SimpleConvNet:
         具有各层的梯度的字典变量
             grads['W1']、grads['W2']、...是各层的权重
             grads['b1']、grads['b2']、...是各层的偏置
+            grads['gamma1']、grads['beta1']是BatchNorm1的参数（use_batchnorm时）
         """
-        # forward
-        self.loss(x, t)
-
-        # backward
-        dout = 1
-        dout = self.last_layer.backward(dout)
-
-        layers = list(self.layers.values())
-        layers.reverse()
-        for layer in layers:
-            dout = layer.backward(dout)
-
-        # 设定
+        if self.checkpoint_segments is not None:
+            x = x.astype(self.dtype, copy=False)
+            checkpoint_gradient(list(self.layers.values()), self.last_layer, x, t, self.checkpoint_segments,
+                                start=self.backward_start)
+        else:
+            # forward
+            self.loss(x, t, train_flg=True)
+
+            # backward
+            dout = 1
+            dout = self.last_layer.backward(dout)
+
+            # 被冻结的层及其之前的层不需要反向传播
+            layers = list(self.layers.values())[self.backward_start:]
+            layers.reverse()
+            for layer in layers:
+                dout = layer.backward(dout)
+
+        # 设定（不包含被冻结的层）
         grads = {}
-        grads['W1'], grads['b1'] = self.layers['Conv1'].dW, self.layers['Conv1'].db
-        grads['W2'], grads['b2'] = self.layers['Affine1'].dW, self.layers['Affine1'].db
-        grads['W3'], grads['b3'] = self.layers['Affine2'].dW, self.layers['Affine2'].db
+        trainable = list(self.layers.keys())[self.backward_start:]
+        for i, key in enumerate(['Conv1', 'Affine1', 'Affine2']):
+            if key in trainable:
+                grads['W' + str(i+1)], grads['b' + str(i+1)] = self.layers[key].dW, self.layers[key].db
+        if 'BatchNorm1' in trainable:
+            grads['gamma1'], grads['beta1'] = self.layers['BatchNorm1'].dgamma, self.layers['BatchNorm1'].dbeta
 
         return grads
         
@@ -154,8 +230,11 @@ class SimpleConvNet:
         with open(file_name, 'rb') as f:
             params = pickle.load(f)
         for key, val in params.items():
-            self.params[key] = val
+            self.params[key] = val.astype(self.dtype, copy=False)
 
         for i, key in enumerate(['Conv1', 'Affine1', 'Affine2']):
             self.layers[key].W = self.params['W' + str(i+1)]
-            self.layers[key].b = self.params['b' + str(i+1)]
\ No newline at end of file
+            self.layers[key].b = self.params['b' + str(i+1)]
+        if self.use_batchnorm:
+            self.layers['BatchNorm1'].gamma = self.params['gamma1']
+            self.layers['BatchNorm1'].beta = self.params['beta1']
\ No newline at end of file
@@ -0,0 +1,32 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import numpy as np
+from deep_convnet import DeepConvNet
+from common.checkpoint import checkpoint_report
+
+# 比较DeepConvNet在不同分段策略下，反向传播缓存的峰值与额外的计算量
+# （峰值包括workspace池中的空闲数组，pool(MB)是其中池的部分）
+batch_size = 100
+network = DeepConvNet()
+# checkpoint_report直接调用各层，不经过gradient()中的astype，输入与网络使用相同的dtype
+x = np.random.rand(batch_size, 1, 28, 28).astype(network.dtype)
+t = np.random.randint(0, 10, batch_size)
+
+num_layers = len(network.layers)
+
+print("layers: " + str(num_layers) + ", batch_size: " + str(batch_size))
+print("%-16s %14s %10s %14s %10s %12s %10s" % ("segments", "peak(MB)", "pool(MB)", "saved(MB)", "time(s)",
+                                               "extra fwd", "time ratio"))
+for segments in ('sqrt', 2, 3, 6, [5, 10, 15]):
+    r = checkpoint_report(network.layers, network.last_layer, x, t, segments,
+                          start=network.backward_start)
+    if segments == 'sqrt':
+        print("%-16s %14.1f %10.1f %14s %10.3f %12s %10s" % ("None", r['baseline_peak_bytes'] / 2**20,
+                                                             r['baseline_pool_bytes'] / 2**20, "-",
+                                                             r['baseline_time'], "-", "-"))
+    print("%-16s %14.1f %10.1f %14.1f %10.3f %12d %9.2fx" % (str(segments), r['checkpoint_peak_bytes'] / 2**20,
+                                                             r['checkpoint_pool_bytes'] / 2**20,
+                                                             r['saved_bytes'] / 2**20, r['checkpoint_time'],
+                                                             r['extra_forward_calls'], r['time_ratio']))
@@ -0,0 +1,52 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from common.util import col2im, col2im_buffered, conv_output_size
+
+# DeepConvNet（batch_size=100）中各卷积层/池化层反向传播时 col2im 的形状
+# (名称, (N, C, H, W), FH, FW, stride, pad)
+layer_shapes = [
+    ('conv1', (100, 1, 28, 28), 3, 3, 1, 1),
+    ('conv2', (100, 16, 28, 28), 3, 3, 1, 1),
+    ('pool1', (100, 16, 28, 28), 2, 2, 2, 0),
+    ('conv3', (100, 16, 14, 14), 3, 3, 1, 1),
+    ('conv4', (100, 32, 14, 14), 3, 3, 1, 2),
+    ('pool2', (100, 32, 16, 16), 2, 2, 2, 0),
+    ('conv5', (100, 32, 8, 8), 3, 3, 1, 1),
+    ('conv6', (100, 64, 8, 8), 3, 3, 1, 1),
+    ('pool3', (100, 64, 8, 8), 2, 2, 2, 0),
+]
+repeat = 10
+
+
+def bench(f, *args, **kwargs):
+    f(*args, **kwargs)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f(*args, **kwargs)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+total_old, total_new = 0.0, 0.0
+print("%-6s %22s %12s %13s %8s" % ("layer", "input", "col2im(ms)", "buffered(ms)", "speedup"))
+for name, shape, fh, fw, stride, pad in layer_shapes:
+    N, C, H, W = shape
+    out_h = int(conv_output_size(H, fh, stride, pad))
+    out_w = int(conv_output_size(W, fw, stride, pad))
+    dcol = np.random.randn(N * out_h * out_w, C * fh * fw)
+    buf = np.empty((N, H + 2*pad, W + 2*pad, C))  # 与层内一样，在多次调用之间重复使用
+
+    # 两种实现的结果必须一致
+    assert np.allclose(col2im(dcol, shape, fh, fw, stride, pad),
+                       col2im_buffered(dcol, shape, fh, fw, stride, pad, out=buf))
+
+    t_old = bench(col2im, dcol, shape, fh, fw, stride, pad)
+    t_new = bench(col2im_buffered, dcol, shape, fh, fw, stride, pad, out=buf)
+    total_old += t_old
+    total_new += t_new
+    print("%-6s %22s %12.3f %13.3f %7.2fx" % (name, str(shape), t_old, t_new, t_old / t_new))
+
+print("%-6s %22s %12.3f %13.3f %7.2fx" % ("total", "", total_old, total_new, total_old / total_new))
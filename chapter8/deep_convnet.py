@@ -6,6 +6,8 @@ import pickle
 import numpy as np
 from collections import OrderedDict
 from common.layers import *
+from common.checkpoint import checkpoint_gradient
+from common.config import get_default_dtype
 
 
 class DeepConvNet:
@@ -16,6 +18,32 @@ class DeepConvNet:
         conv - relu - conv- relu - pool -
         conv - relu - conv- relu - pool -
         affine - relu - dropout - affine - dropout - softmax
+
+    conv_algo : 卷积层的计算方式（'im2col'、'winograd'、'fft' or 'auto'，参见common/layers.Convolution）
+    checkpoint_segments : 激活值检查点的分段策略（None表示不使用，参见common/checkpoint.py）
+        使用时gradient()只保留各段的输入，反向传播时重新计算段内各层的缓存
+    layout : 卷积部分的数据排列，'NCHW'（默认）或 'NHWC'
+        NHWC时只在输入处和全连接层之前各转置一次，卷积层、池化层之间不再转置；
+        输入数据和参数的形状与NCHW时相同
+    fuse_conv_relu_pool : 为True时把池化层之前的 conv - relu - pool 换成融合层ConvReluPool
+        （im2col计算，不保留卷积的输出和ReLU的掩码）
+    num_workers : 卷积层im2col路径的线程数（默认1，参见common/layers.Convolution）
+    parallel_backward : 为True时各层反向传播的dx和dW同时计算（参见common/layers.Affine、Convolution）
+    use_batchnorm : 为True时在各卷积层之后插入按通道归一化的BatchNormalization（spatial=True），
+        即 conv - bn - relu；参数为 gamma1~gamma6、beta1~beta6（形状为各层的 (filter_num,)）。
+        不能与fuse_conv_relu_pool同时使用
+    global_pool : 为True时最后的池化层之后接全局平均池化（GlobalAvgPooling），
+        W7的形状从 (64*4*4, hidden_size) 变为 (64, hidden_size)（64为conv_param_6的filter_num）
+
+    conv_param_* 中可以指定 'groups'（分组卷积的组数，默认1），该层的滤波器为
+    (filter_num, 输入通道数/groups, filter_size, filter_size)。例如
+        conv_param_2 = {'filter_num':16, 'filter_size':3, 'pad':1, 'stride':1, 'groups':16}
+    把第2层换成depthwise卷积，与后面的普通卷积一起构成depthwise-separable的结构。
+    groups > 1 的层总是使用im2col计算。
+    'filter_size':1, 'pad':0 的层（1x1的bottleneck）不经过im2col，直接按通道做矩阵乘法
+    （参见common/layers.Convolution），conv_algo为'winograd'时这些层也使用该路径。
+
+    参数和输入使用生成时的 common.config.get_default_dtype()（self.dtype）
     """
     def __init__(self, input_dim=(1, 28, 28),
                 conv_param_1 = {'filter_num':16, 'filter_size':3, 'pad':1, 'stride':1},
@@ -24,57 +52,98 @@ class DeepConvNet:
                 conv_param_4 = {'filter_num':32, 'filter_size':3, 'pad':2, 'stride':1},
                 conv_param_5 = {'filter_num':64, 'filter_size':3, 'pad':1, 'stride':1},
                 conv_param_6 = {'filter_num':64, 'filter_size':3, 'pad':1, 'stride':1},
-                hidden_size=50, output_size=10):
+                hidden_size=50, output_size=10, conv_algo='im2col', checkpoint_segments=None,
+                layout='NCHW', fuse_conv_relu_pool=False, num_workers=1, parallel_backward=False,
+                use_batchnorm=False, global_pool=False):
+        if use_batchnorm and fuse_conv_relu_pool:
+            raise ValueError("use_batchnorm cannot be combined with fuse_conv_relu_pool")
         # 初始化权重===========
         # 各层的神经元平均与前一层的几个神经元有连接（TODO:自动计算）
         pre_node_nums = np.array([1*3*3, 16*3*3, 16*3*3, 32*3*3, 32*3*3, 64*3*3, 64*4*4, hidden_size])
         wight_init_scales = np.sqrt(2.0 / pre_node_nums)  # 使用ReLU的情况下推荐的初始值
         
+        self.dtype = get_default_dtype()
         self.params = {}
         pre_channel_num = input_dim[0]
-        for idx, conv_param in enumerate([conv_param_1, conv_param_2, conv_param_3, conv_param_4, conv_param_5, conv_param_6]):
-            self.params['W' + str(idx+1)] = wight_init_scales[idx] * np.random.randn(conv_param['filter_num'], pre_channel_num, conv_param['filter_size'], conv_param['filter_size'])
-            self.params['b' + str(idx+1)] = np.zeros(conv_param['filter_num'])
+        conv_params = [conv_param_1, conv_param_2, conv_param_3, conv_param_4, conv_param_5, conv_param_6]
+        for idx, conv_param in enumerate(conv_params):
+            # 卷积层的输入节点数按实际的滤波器形状计算（分组卷积时为 输入通道数/groups * FH * FW）
+            groups = conv_param.get('groups', 1)
+            filter_shape = (conv_param['filter_num'], pre_channel_num // groups,
+                            conv_param['filter_size'], conv_param['filter_size'])
+            wight_init_scales[idx] = np.sqrt(2.0 / np.prod(filter_shape[1:]))
+            self.params['W' + str(idx+1)] = (wight_init_scales[idx] * np.random.randn(*filter_shape)).astype(self.dtype)
+            self.params['b' + str(idx+1)] = np.zeros(conv_param['filter_num'], dtype=self.dtype)
+            if use_batchnorm:
+                self.params['gamma' + str(idx+1)] = np.ones(conv_param['filter_num'], dtype=self.dtype)
+                self.params['beta' + str(idx+1)] = np.zeros(conv_param['filter_num'], dtype=self.dtype)
             pre_channel_num = conv_param['filter_num']
-        self.params['W7'] = wight_init_scales[6] * np.random.randn(64*4*4, hidden_size)
-        self.params['b7'] = np.zeros(hidden_size)
-        self.params['W8'] = wight_init_scales[7] * np.random.randn(hidden_size, output_size)
-        self.params['b8'] = np.zeros(output_size)
+        # 全局平均池化时全连接层的输入为最后一个卷积层的各通道的平均值
+        affine_input_size = pre_channel_num if global_pool else 64*4*4
+        wight_init_scales[6] = np.sqrt(2.0 / affine_input_size)
+        self.params['W7'] = (wight_init_scales[6] * np.random.randn(affine_input_size, hidden_size)).astype(self.dtype)
+        self.params['b7'] = np.zeros(hidden_size, dtype=self.dtype)
+        self.params['W8'] = (wight_init_scales[7] * np.random.randn(hidden_size, output_size)).astype(self.dtype)
+        self.params['b8'] = np.zeros(output_size, dtype=self.dtype)
 
         # 生成层===========
+        # 每两个卷积层之后接一个池化层
         self.layers = []
-        self.layers.append(Convolution(self.params['W1'], self.params['b1'], 
-                           conv_param_1['stride'], conv_param_1['pad']))
-        self.layers.append(Relu())
-        self.layers.append(Convolution(self.params['W2'], self.params['b2'], 
-                           conv_param_2['stride'], conv_param_2['pad']))
-        self.layers.append(Relu())
-        self.layers.append(Pooling(pool_h=2, pool_w=2, stride=2))
-        self.layers.append(Convolution(self.params['W3'], self.params['b3'], 
-                           conv_param_3['stride'], conv_param_3['pad']))
-        self.layers.append(Relu())
-        self.layers.append(Convolution(self.params['W4'], self.params['b4'],
-                           conv_param_4['stride'], conv_param_4['pad']))
-        self.layers.append(Relu())
-        self.layers.append(Pooling(pool_h=2, pool_w=2, stride=2))
-        self.layers.append(Convolution(self.params['W5'], self.params['b5'],
-                           conv_param_5['stride'], conv_param_5['pad']))
-        self.layers.append(Relu())
-        self.layers.append(Convolution(self.params['W6'], self.params['b6'],
-                           conv_param_6['stride'], conv_param_6['pad']))
-        self.layers.append(Relu())
-        self.layers.append(Pooling(pool_h=2, pool_w=2, stride=2))
-        self.layers.append(Affine(self.params['W7'], self.params['b7']))
-        self.layers.append(Relu())
+        if layout == 'NHWC':
+            self.layers.append(Transpose((0, 2, 3, 1)))  # 输入 NCHW -> NHWC
+        for idx, conv_param in enumerate(conv_params):
+            W, b = self.params['W' + str(idx+1)], self.params['b' + str(idx+1)]
+            groups = conv_param.get('groups', 1)
+            if idx % 2 == 1 and fuse_conv_relu_pool:
+                self.layers.append(ConvReluPool(W, b, conv_param['stride'], conv_param['pad'],
+                                                pool_size=2, layout=layout, groups=groups,
+                                                num_workers=num_workers, parallel_backward=parallel_backward))
+                continue
+            algo = conv_algo if groups == 1 and conv_param['filter_size'] != 1 else 'im2col'
+            self.layers.append(Convolution(W, b, conv_param['stride'], conv_param['pad'], algo, layout, groups,
+                                           num_workers, parallel_backward))
+            if use_batchnorm:
+                self.layers.append(BatchNormalization(self.params['gamma' + str(idx+1)],
+                                                      self.params['beta' + str(idx+1)], layout=layout, spatial=True))
+            self.layers.append(Relu(inplace=True))  # 卷积层的输出不再被使用，原地计算
+            if idx % 2 == 1:
+                self.layers.append(Pooling(pool_h=2, pool_w=2, stride=2, layout=layout))
+        if global_pool:
+            self.layers.append(GlobalAvgPooling(layout))  # 输出 (N, C)，不需要转换回NCHW
+        elif layout == 'NHWC':
+            self.layers.append(Transpose((0, 3, 1, 2)))  # 展开前转换回NCHW，W7的排列与NCHW时相同
+        self.layers.append(Affine(self.params['W7'], self.params['b7'], parallel_backward))
+        self.layers.append(Relu(inplace=True))
         self.layers.append(Dropout(0.5))
-        self.layers.append(Affine(self.params['W8'], self.params['b8']))
+        self.layers.append(Affine(self.params['W8'], self.params['b8'], parallel_backward))
         self.layers.append(Dropout(0.5))
+
+        # W1~W8对应的层在self.layers中的位置
+        self.param_layer_idxs = [i for i, layer in enumerate(self.layers) if hasattr(layer, 'W')]
+        # gamma1~gamma6、beta1~beta6对应的层的位置（use_batchnorm时）
+        self.bn_layer_idxs = [i for i, layer in enumerate(self.layers) if isinstance(layer, BatchNormalization)]
         
         self.last_layer = SoftmaxWithLoss()
+        self.checkpoint_segments = checkpoint_segments
+
+        # 反向传播到第一个卷积层为止，对输入图像的梯度不再计算（参见freeze_prefix）
+        self.frozen = 0
+        self.backward_start = backward_start(self.layers)
+
+    def freeze_prefix(self, n):
+        """冻结前n个有参数的层（W1~W8对应的层，use_batchnorm时也包括各BatchNormalization层）
+
+        gradient()不再计算被冻结的层的梯度，返回的dict中也不包含它们的参数（优化器只更新dict中的参数）。
+        反向传播到第一个没有被冻结的有参数的层为止，该层的输入梯度（dx）也不计算。n=0时解除冻结。
+        被冻结的BatchNormalization层学习时也使用移动平均归一化，不再更新running_mean、running_var。
+        """
+        self.frozen = n
+        self.backward_start = backward_start(self.layers, n)
 
     def predict(self, x, train_flg=False):
+        x = x.astype(self.dtype, copy=False)
         for layer in self.layers:
-            if isinstance(layer, Dropout):
+            if isinstance(layer, (Dropout, BatchNormalization)):
                 x = layer.forward(x, train_flg)
             else:
                 x = layer.forward(x)
@@ -99,23 +168,36 @@ class DeepConvNet:
         return acc / x.shape[0]
 
     def gradient(self, x, t):
-        # forward
-        self.loss(x, t)
-
-        # backward
-        dout = 1
-        dout = self.last_layer.backward(dout)
-
-        tmp_layers = self.layers.copy()
-        tmp_layers.reverse()
-        for layer in tmp_layers:
-            dout = layer.backward(dout)
-
-        # 设定
+        if self.checkpoint_segments is not None:
+            x = x.astype(self.dtype, copy=False)
+            checkpoint_gradient(self.layers, self.last_layer, x, t, self.checkpoint_segments,
+                                start=self.backward_start)
+        else:
+            # forward
+            self.loss(x, t)
+
+            # backward
+            dout = 1
+            dout = self.last_layer.backward(dout)
+
+            # 被冻结的层及其之前的层不需要反向传播
+            tmp_layers = self.layers[self.backward_start:]
+            tmp_layers.reverse()
+            for layer in tmp_layers:
+                dout = layer.backward(dout)
+
+        # 设定（不包含被冻结的层）
         grads = {}
-        for i, layer_idx in enumerate((0, 2, 5, 7, 10, 12, 15, 18)):
+        for i, layer_idx in enumerate(self.param_layer_idxs):
+            if layer_idx < self.backward_start:
+                continue
             grads['W' + str(i+1)] = self.layers[layer_idx].dW
             grads['b' + str(i+1)] = self.layers[layer_idx].db
+        for i, layer_idx in enumerate(self.bn_layer_idxs):
+            if layer_idx < self.backward_start:
+                continue
+            grads['gamma' + str(i+1)] = self.layers[layer_idx].dgamma
+            grads['beta' + str(i+1)] = self.layers[layer_idx].dbeta
 
         return grads
 
@@ -130,8 +212,11 @@ class DeepConvNet:
         with open(file_name, 'rb') as f:
             params = pickle.load(f)
         for key, val in params.items():
-            self.params[key] = val
+            self.params[key] = val.astype(self.dtype, copy=False)
 
-        for i, layer_idx in enumerate((0, 2, 5, 7, 10, 12, 15, 18)):
+        for i, layer_idx in enumerate(self.param_layer_idxs):
             self.layers[layer_idx].W = self.params['W' + str(i+1)]
             self.layers[layer_idx].b = self.params['b' + str(i+1)]
+        for i, layer_idx in enumerate(self.bn_layer_idxs):
+            self.layers[layer_idx].gamma = self.params['gamma' + str(i+1)]
+            self.layers[layer_idx].beta = self.params['beta' + str(i+1)]
@@ -0,0 +1,37 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from deep_convnet import DeepConvNet
+from common.optimizer import Adam
+from common.config import set_default_dtype
+
+# DeepConvNet在float64和float32下一次训练迭代（gradient + Adam.update）的时间，
+# 并确认float32时梯度和参数没有被提升为float64
+batch_size = 100
+iters = 5
+x = np.random.rand(batch_size, 1, 28, 28).astype(np.float32)  # 与load_mnist的输出相同
+t = np.random.randint(0, 10, batch_size)
+
+print("%8s %10s %14s %14s" % ("dtype", "time(s)", "params(MB)", "dtypes"))
+for dtype in (np.float64, np.float32):
+    old = set_default_dtype(dtype)
+    np.random.seed(0)
+    network = DeepConvNet()
+    optimizer = Adam()
+    set_default_dtype(old)
+
+    total = 0.0
+    for i in range(iters):
+        start = time.perf_counter()
+        grads = network.gradient(x, t)
+        optimizer.update(network.params, grads)
+        if i > 0:
+            total += time.perf_counter() - start  # 第一次迭代包含缓冲区的初次分配，不计入平均
+
+    nbytes = sum(p.nbytes for p in network.params.values())
+    grad_dtypes = set(g.dtype.name for g in grads.values()) | set(p.dtype.name for p in network.params.values())
+    print("%8s %10.3f %14.2f %14s" % (np.dtype(dtype).name, total / (iters - 1), nbytes / 2**20,
+                                      ",".join(sorted(grad_dtypes))))
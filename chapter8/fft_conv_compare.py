@@ -0,0 +1,63 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from common.layers import Convolution
+from common import fft_conv
+
+# 比较各形状下im2col与FFT卷积的前向+反向传播时间，求出 fft_conv.FFT_OVERHEAD 的取值：
+# algo='auto' 在 FFT_OVERHEAD * fft_cost_ratio < 1 时选择FFT，
+# 选择使所有形状的合计时间（各形状按选择的计算方式）最小的系数
+repeat = 3
+# (N, C, H, FN, FH, pad)：DeepConvNet/SimpleConvNet的各层，以及较大的滤波器和图像
+shapes = [(100, 1, 28, 16, 3, 1), (100, 16, 28, 16, 3, 1), (100, 16, 14, 32, 3, 1),
+          (100, 32, 14, 32, 3, 2), (100, 32, 7, 64, 3, 1), (100, 64, 7, 64, 3, 1),
+          (100, 1, 28, 30, 5, 0), (100, 16, 28, 32, 5, 2), (100, 16, 28, 32, 7, 3),
+          (16, 3, 64, 16, 3, 1), (16, 16, 64, 32, 5, 2), (8, 16, 128, 16, 7, 3), (8, 3, 128, 16, 11, 5)]
+
+
+def measure(algo, x, W, b, pad, dout):
+    layer = Convolution(W.copy(), b, pad=pad, algo=algo)
+    best = float('inf')
+    for i in range(repeat + 1):
+        layer.W *= 1.0 + 1e-6  # 学习时W每次迭代都会更新，FFT路径需要重新变换滤波器
+        start = time.perf_counter()
+        layer.forward(x)
+        layer.backward(dout)
+        if i > 0:  # 第一次作为预热
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+print("%-28s %10s %12s %10s %10s" % ("N,C,H / FN,FH,pad", "model", "im2col(ms)", "fft(ms)", "measured"))
+results = []
+for N, C, H, FN, FH, pad in shapes:
+    x = np.random.randn(N, C, H, H)
+    W = 0.1 * np.random.randn(FN, C, FH, FH)
+    b = np.zeros(FN)
+    out_h = H + 2*pad - FH + 1
+    dout = np.random.randn(N, FN, out_h, out_h)
+
+    model = fft_conv.fft_cost_ratio(x.shape, W.shape, 1, pad)
+    t_im2col = measure('im2col', x, W, b, pad, dout)
+    t_fft = measure('fft', x, W, b, pad, dout)
+    results.append((model, t_im2col, t_fft))
+    print("%-28s %10.3f %12.3f %10.3f %10.3f" % ("%d,%d,%d / %d,%d,%d" % (N, C, H, FN, FH, pad),
+                                                model, t_im2col * 1e3, t_fft * 1e3, t_fft / t_im2col))
+
+
+def total_time(overhead):
+    return sum(t_fft if overhead * model < 1.0 else t_im2col for model, t_im2col, t_fft in results)
+
+
+# 选择只在 1/model 处改变，候选取各个切换点的两侧和当前值
+candidates = sorted({fft_conv.FFT_OVERHEAD} | {f / model for model, _, _ in results for f in (0.999, 1.001)})
+best = min(candidates, key=lambda c: (total_time(c), abs(np.log(c))))
+best_range = [c for c in candidates if total_time(c) == total_time(best)]
+ideal = sum(min(t_im2col, t_fft) for _, t_im2col, t_fft in results)
+print("\nmodel: fft_cost_ratio（FFT/im2col的计算量之比），measured: FFT/im2col的时间之比")
+print("FFT_OVERHEAD = %.2f: total %.1f ms" % (fft_conv.FFT_OVERHEAD, total_time(fft_conv.FFT_OVERHEAD) * 1e3))
+print("best FFT_OVERHEAD = %.2f (%.2f ~ %.2f): total %.1f ms（每个形状都选对时 %.1f ms）" % (
+    best, min(best_range), max(best_range), total_time(best) * 1e3, ideal * 1e3))
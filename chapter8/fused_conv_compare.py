@@ -0,0 +1,49 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../chapter7')
+import time
+import numpy as np
+from deep_convnet import DeepConvNet
+from simple_convnet import SimpleConvNet
+from common.checkpoint import checkpoint_gradient
+
+# 比较 conv - relu - pool 分开的三层与融合层ConvReluPool：
+# 每次迭代（gradient）的时间，以及反向传播开始时各层缓存的激活值的大小
+# （ckpt：使用检查点（segments='sqrt'）时缓存的峰值，NHWC的网络在第一个卷积层之前有Transpose层）
+batch_size = 100
+repeat = 5
+x = np.random.rand(batch_size, 1, 28, 28)
+t = np.random.randint(0, 10, batch_size)
+
+
+def bench(network):
+    layers = network.layers if isinstance(network.layers, list) else list(network.layers.values())
+    stats = {}
+    np.random.seed(0)
+    checkpoint_gradient(layers, network.last_layer, x, t, None, stats)  # 同时作为预热
+    ckpt_stats = {}
+    checkpoint_gradient(layers, network.last_layer, x, t, 'sqrt', ckpt_stats)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        network.gradient(x, t)
+    return (time.perf_counter() - start) / repeat, stats['peak_bytes'], ckpt_stats['peak_bytes'], len(layers)
+
+
+print("batch_size: " + str(batch_size))
+print("%-14s %-6s %-7s %7s %10s %10s %10s" % ("network", "layout", "fused", "layers", "time(s)", "cache(MB)",
+                                              "ckpt(MB)"))
+for cls in (SimpleConvNet, DeepConvNet):
+    for layout in ('NCHW', 'NHWC'):
+        results = []
+        for fused in (False, True):
+            np.random.seed(1)
+            network = cls(layout=layout, fuse_conv_relu_pool=fused)
+            elapsed, nbytes, ckpt_nbytes, num_layers = bench(network)
+            results.append((elapsed, nbytes))
+            print("%-14s %-6s %-7s %7d %10.3f %10.1f %10.1f" % (cls.__name__, layout, fused, num_layers,
+                                                              elapsed, nbytes / 2**20, ckpt_nbytes / 2**20))
+        print("%-14s %-6s %-7s %7s %9.2fx %9.2fx" % ("", "", "ratio", "", results[0][0] / results[1][0],
+                                                     results[0][1] / results[1][1]))
@@ -0,0 +1,52 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../chapter7')
+import time
+import numpy as np
+from common.layers import Pooling, AvgPooling
+from deep_convnet import DeepConvNet
+from simple_convnet import SimpleConvNet
+
+# 比较展开后接大的全连接层（默认）与全局平均池化（global_pool=True）的参数量、推理和学习的时间
+batch_size = 100
+repeat = 5
+x = np.random.rand(batch_size, 1, 28, 28)
+t = np.random.randint(0, 10, batch_size)
+
+
+def bench(func):
+    func()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+print("batch_size: " + str(batch_size))
+print("%-14s %12s %10s %12s %14s %14s" % ("network", "global_pool", "params", "head W", "predict(ms)", "gradient(ms)"))
+for name, cls, head in (("SimpleConvNet", SimpleConvNet, 'W2'), ("DeepConvNet", DeepConvNet, 'W7')):
+    for global_pool in (False, True):
+        np.random.seed(0)
+        network = cls(global_pool=global_pool)
+        params = sum(p.size for p in network.params.values())
+        t_predict = bench(lambda: network.predict(x))
+        t_gradient = bench(lambda: network.gradient(x, t))
+        print("%-14s %12s %10d %12s %14.3f %14.3f" % (name, global_pool, params, str(network.params[head].shape),
+                                                     t_predict * 1e3, t_gradient * 1e3))
+
+# 2x2（步幅2）的池化层：Max池化与平均池化的前向+反向传播时间（平均池化不需要记录最大值的位置）
+print("\n%-12s %14s %14s" % ("C,H,W", "max(ms)", "avg(ms)"))
+for C, H in ((16, 28), (32, 14), (64, 8)):
+    fm = np.random.randn(batch_size, C, H, H)
+    dout = np.random.randn(batch_size, C, H // 2, H // 2)
+    times = []
+    for layer in (Pooling(2, 2, stride=2), AvgPooling(2, 2, stride=2)):
+        def step():
+            layer.forward(fm)
+            layer.backward(dout)
+        times.append(bench(step))
+    print("%-12s %14.3f %14.3f" % ("%d,%d,%d" % (C, H, H), times[0] * 1e3, times[1] * 1e3))
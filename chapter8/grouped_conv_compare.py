@@ -0,0 +1,53 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from deep_convnet import DeepConvNet
+from common.layers import Convolution
+
+# 比较DeepConvNet与把第2、4、6层换成depthwise卷积（groups=输入通道数）的版本：
+# 卷积部分的参数量、乘加次数（推理时）以及推理/学习的时间
+batch_size = 100
+repeat = 5
+x = np.random.rand(batch_size, 1, 28, 28)
+t = np.random.randint(0, 10, batch_size)
+
+depthwise = {
+    'conv_param_2': {'filter_num':16, 'filter_size':3, 'pad':1, 'stride':1, 'groups':16},
+    'conv_param_4': {'filter_num':32, 'filter_size':3, 'pad':2, 'stride':1, 'groups':32},
+    'conv_param_6': {'filter_num':64, 'filter_size':3, 'pad':1, 'stride':1, 'groups':64},
+}
+
+
+def conv_cost(network, x):
+    """卷积层的参数量与每个样本的乘加次数"""
+    params, macs = 0, 0
+    for layer in network.layers:
+        if isinstance(layer, Convolution):
+            positions = layer.col.shape[0] // x.shape[0]  # 每个样本的输出位置数
+            params += layer.W.size + layer.b.size
+            macs += layer.W.size * positions
+    return params, macs
+
+
+def bench(f):
+    f()  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat
+
+
+print("batch_size: " + str(batch_size))
+print("%-10s %-6s %12s %14s %12s %12s" % ("network", "layout", "conv params", "conv MACs", "predict(s)",
+                                          "gradient(s)"))
+for layout in ('NCHW', 'NHWC'):
+    for name, kwargs in (('dense', {}), ('depthwise', depthwise)):
+        np.random.seed(0)
+        network = DeepConvNet(layout=layout, **kwargs)
+        t_predict = bench(lambda: network.predict(x))
+        params, macs = conv_cost(network, x)
+        t_grad = bench(lambda: network.gradient(x, t))
+        print("%-10s %-6s %12d %14d %12.3f %12.3f" % (name, layout, params, macs, t_predict, t_grad))
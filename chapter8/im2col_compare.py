@@ -0,0 +1,47 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from common.util import im2col, im2col_strided
+
+# DeepConvNet（batch_size=100）中各卷积层/池化层的 im2col 输入形状
+# (名称, (N, C, H, W), FH, FW, stride, pad)
+layer_shapes = [
+    ('conv1', (100, 1, 28, 28), 3, 3, 1, 1),
+    ('conv2', (100, 16, 28, 28), 3, 3, 1, 1),
+    ('pool1', (100, 16, 28, 28), 2, 2, 2, 0),
+    ('conv3', (100, 16, 14, 14), 3, 3, 1, 1),
+    ('conv4', (100, 32, 14, 14), 3, 3, 1, 2),
+    ('pool2', (100, 32, 16, 16), 2, 2, 2, 0),
+    ('conv5', (100, 32, 8, 8), 3, 3, 1, 1),
+    ('conv6', (100, 64, 8, 8), 3, 3, 1, 1),
+    ('pool3', (100, 64, 8, 8), 2, 2, 2, 0),
+]
+repeat = 10
+
+
+def bench(f, *args):
+    f(*args)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f(*args)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+total_old, total_new = 0.0, 0.0
+print("%-6s %22s %12s %12s %8s" % ("layer", "input", "im2col(ms)", "strided(ms)", "speedup"))
+for name, shape, fh, fw, stride, pad in layer_shapes:
+    x = np.random.randn(*shape).astype(np.float32)
+
+    # 两种实现的结果必须一致
+    assert np.array_equal(im2col(x, fh, fw, stride, pad), im2col_strided(x, fh, fw, stride, pad))
+
+    t_old = bench(im2col, x, fh, fw, stride, pad)
+    t_new = bench(im2col_strided, x, fh, fw, stride, pad)
+    total_old += t_old
+    total_new += t_new
+    print("%-6s %22s %12.3f %12.3f %7.2fx" % (name, str(shape), t_old, t_new, t_old / t_new))
+
+print("%-6s %22s %12.3f %12.3f %7.2fx" % ("total", "", total_old, total_new, total_old / total_new))
@@ -0,0 +1,45 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from deep_convnet import DeepConvNet
+from common.memory_planner import plan_memory
+
+# DeepConvNet各层输出的静态内存规划：各层各自分配（naive）与arena的峰值对比，
+# 并确认使用arena时梯度与各自分配时相同
+batch_size = 100
+iters = 5
+x = np.random.rand(batch_size, 1, 28, 28)
+t = np.random.randint(0, 10, batch_size)
+
+np.random.seed(0)
+network = DeepConvNet()
+np.random.seed(0)
+planned_network = DeepConvNet()
+
+predict_plan = plan_memory(planned_network, x.shape, train=False)
+print("== predict (train=False)")
+print(predict_plan.report())
+
+plan = plan_memory(planned_network, x.shape, train=True)
+print("\n== gradient (train=True)")
+print(plan.report())
+
+
+def bench(net):
+    net.gradient(x, t)  # 预热
+    start = time.perf_counter()
+    for _ in range(iters):
+        net.gradient(x, t)
+    return (time.perf_counter() - start) / iters
+
+
+plan.apply()
+grads = {k: v.copy() for k, v in network.gradient(x, t).items()}
+planned_grads = planned_network.gradient(x, t)
+diff = max(np.abs(grads[k] - planned_grads[k]).max() for k in grads)
+print("\nmax grad diff: %g" % diff)
+print("gradient time: naive %.3f s, planned %.3f s" % (bench(network), bench(planned_network)))
+plan.remove()
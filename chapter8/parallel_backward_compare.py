@@ -0,0 +1,54 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from deep_convnet import DeepConvNet
+
+# 比较DeepConvNet各层（Convolution、Affine）的反向传播在 parallel_backward 开关前后的时间
+# dx和dW的矩阵乘法同时执行，mini-batch较小、单个GEMM用不满BLAS的线程时效果明显；
+# 第一个卷积层不计算dx（need_dx=False），没有可以同时执行的计算
+batch_sizes = [32, 64, 128, 256]
+repeat = 5
+
+np.random.seed(0)
+network = DeepConvNet()
+print("cpu_count: " + str(os.cpu_count()))
+
+for batch_size in batch_sizes:
+    x = np.random.rand(batch_size, 1, 28, 28)
+    t = np.random.randint(0, 10, batch_size)
+
+    # 前向传播后记录各层反向传播的输入dout
+    network.loss(x, t)
+    dout = network.last_layer.backward(1)
+    douts = {}
+    for i in reversed(range(len(network.layers))):
+        douts[i] = dout
+        dout = network.layers[i].backward(dout)
+        if dout is None:
+            break
+
+    print("\nbatch_size: " + str(batch_size))
+    print("%4s %-12s %12s %12s %8s %10s" % ("idx", "layer", "serial(ms)", "parallel(ms)", "speedup", "identical"))
+    total = [0.0, 0.0]
+    for i in network.param_layer_idxs:
+        layer = network.layers[i]
+        times, results = [], []
+        for parallel in (False, True):
+            layer.parallel_backward = parallel
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                dx = layer.backward(douts[i])
+                best = min(best, time.perf_counter() - start)
+            times.append(best)
+            results.append([None if dx is None else dx.copy(), layer.dW.copy(), layer.db.copy()])
+        layer.parallel_backward = False
+        identical = all(a is None and b is None or np.array_equal(a, b) for a, b in zip(*results))
+        total[0] += times[0]
+        total[1] += times[1]
+        print("%4d %-12s %12.3f %12.3f %7.2fx %10s" % (i, type(layer).__name__, times[0] * 1e3, times[1] * 1e3,
+                                                     times[0] / times[1], identical))
+    print("%4s %-12s %12.3f %12.3f %7.2fx" % ("", "total", total[0] * 1e3, total[1] * 1e3, total[0] / total[1]))
@@ -0,0 +1,46 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from deep_convnet import DeepConvNet
+from common.layers import Dropout
+
+# 比较DeepConvNet在不同线程数（num_workers）下每次迭代的时间，并确认结果是确定的
+# BLAS本身也是多线程时，建议设定 OPENBLAS_NUM_THREADS=1 等后再比较
+batch_size = 100
+repeat = 3
+x = np.random.rand(batch_size, 1, 28, 28)
+t = np.random.randint(0, 10, batch_size)
+worker_list = [1, 2, 4, 8, 16, 32]
+
+
+def reset_dropout(network):
+    # Dropout的掩码由各层自己的随机数生成器生成（种子在生成层时从np.random取得），
+    # 调用gradient之后生成器的状态会前进，所以每次都换成同样种子的新生成器，让每次都从同样的状态开始
+    for i, layer in enumerate(network.layers):
+        if isinstance(layer, Dropout):
+            layer.rng = np.random.default_rng(i)
+
+
+print("cpu_count: " + str(os.cpu_count()) + ", batch_size: " + str(batch_size))
+print("%8s %10s %8s %16s %14s" % ("workers", "time(s)", "speedup", "max|dW - dW(1)|", "deterministic"))
+base_time, base_grads = None, None
+for num_workers in worker_list:
+    np.random.seed(0)
+    network = DeepConvNet(num_workers=num_workers)
+    reset_dropout(network)
+    grads = {k: v.copy() for k, v in network.gradient(x, t).items()}  # 同时作为预热
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        reset_dropout(network)
+        again = network.gradient(x, t)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    deterministic = all(np.array_equal(grads[k], again[k]) for k in grads)
+    if base_grads is None:
+        base_time, base_grads = elapsed, grads
+    diff = max(np.abs(grads[k] - base_grads[k]).max() for k in grads)
+    print("%8d %10.3f %7.2fx %16.2e %14s" % (num_workers, elapsed, base_time / elapsed, diff, deterministic))
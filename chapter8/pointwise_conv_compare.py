@@ -0,0 +1,50 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from common.layers import Convolution
+
+# 比较1x1卷积（步幅1、无填充）的快速路径与im2col路径的前向+反向传播时间
+# 形状取自在DeepConvNet中插入1x1 bottleneck层的情况（28x28、14x14、7x7）
+batch_size = 100
+repeat = 5
+shapes = [(16, 16, 28), (16, 32, 14), (32, 64, 14), (64, 32, 7), (64, 64, 7)]  # (C, FN, H=W)
+
+
+def measure(layer, x, dout):
+    layer.forward(x)
+    layer.backward(dout)  # 预热（workspace的缓冲区）
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        y = layer.forward(x)
+        dx = layer.backward(dout)
+        best = min(best, time.perf_counter() - start)
+    return best, [y.copy(), dx.copy(), layer.dW.copy(), layer.db.copy()]
+
+
+print("batch_size: " + str(batch_size))
+for layout in ('NCHW', 'NHWC'):
+    print("\nlayout: " + layout)
+    print("%4s %4s %4s %12s %14s %8s %12s" % ("C", "FN", "H", "im2col(ms)", "pointwise(ms)", "speedup", "max diff"))
+    for C, FN, H in shapes:
+        W = np.sqrt(2.0 / C) * np.random.randn(FN, C, 1, 1)
+        b = np.zeros(FN)
+        x = np.random.randn(batch_size, C, H, H)
+        dout = np.random.randn(batch_size, FN, H, H)
+        if layout == 'NHWC':
+            x = np.ascontiguousarray(x.transpose(0, 2, 3, 1))
+            dout = np.ascontiguousarray(dout.transpose(0, 2, 3, 1))
+
+        # 同样的层关闭快速路径，作为im2col路径的基准
+        slow = Convolution(W, b, layout=layout)
+        slow._is_pointwise = lambda: False
+        fast = Convolution(W, b, layout=layout)
+        slow_time, slow_res = measure(slow, x, dout)
+        fast_time, fast_res = measure(fast, x, dout)
+
+        diff = max(np.abs(a - c).max() for a, c in zip(slow_res, fast_res))
+        print("%4d %4d %4d %12.3f %14.3f %7.2fx %12.2e" % (C, FN, H, slow_time * 1e3, fast_time * 1e3,
+                                                         slow_time / fast_time, diff))
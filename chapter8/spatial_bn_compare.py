@@ -0,0 +1,49 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from common.layers import BatchNormalization
+from deep_convnet import DeepConvNet
+
+# 卷积层之后的BatchNormalization：按元素（spatial=False，展开为 (N, C*H*W)）与按通道（spatial=True）
+# 比较参数+移动平均的元素数和前向+反向传播的时间（形状取自DeepConvNet的各卷积层的输出）
+batch_size = 100
+repeat = 5
+shapes = [(16, 28, 28), (32, 14, 14), (64, 7, 7)]  # (C, H, W)
+
+
+def bench(func):
+    func()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+print("batch_size: " + str(batch_size))
+print("%-12s %14s %14s %14s %14s" % ("C,H,W", "state(elem)", "state(spatial)", "time(ms)", "time(spatial)"))
+for C, H, W in shapes:
+    x = np.random.randn(batch_size, C, H, W)
+    dout = np.random.randn(batch_size, C, H, W)
+    row = []
+    for spatial in (False, True):
+        D = C if spatial else C * H * W
+        bn = BatchNormalization(np.ones(D), np.zeros(D), spatial=spatial)
+        t = bench(lambda: bn.backward(bn.forward(x, train_flg=True)))
+        state = bn.gamma.size + bn.beta.size + bn.running_mean.size + bn.running_var.size
+        row.append((state, t))
+    print("%-12s %14d %14d %14.3f %14.3f" % ("%d,%d,%d" % (C, H, W), row[0][0], row[1][0],
+                                            row[0][1] * 1e3, row[1][1] * 1e3))
+
+# DeepConvNet整体：每次迭代（gradient）的时间
+x = np.random.rand(batch_size, 1, 28, 28)
+t = np.random.randint(0, 10, batch_size)
+for use_batchnorm in (False, True):
+    network = DeepConvNet(use_batchnorm=use_batchnorm)
+    elapsed = bench(lambda: network.gradient(x, t))
+    print("DeepConvNet(use_batchnorm=%s): %.3f s / iteration, %d params" % (
+        use_batchnorm, elapsed, sum(p.size for p in network.params.values())))
@@ -0,0 +1,38 @@
+# coding: utf-8
+import sys, os
+#sys.path.append(os.pardir)  # 为了导入父目录的文件而进行的设定
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import time
+import numpy as np
+from deep_convnet import DeepConvNet
+from common.workspace import Workspace, set_workspace
+
+# DeepConvNet训练时workspace的分配次数，以及与不复用缓冲区（max_bytes=0）时的速度对比
+# max_bytes是借出中（lent，各层保留的col等）与池中空闲（pooled）数组之和的上限，上限越小池中保留的越少
+batch_size = 100
+iters = 5
+x = np.random.rand(batch_size, 1, 28, 28)
+t = np.random.randint(0, 10, batch_size)
+
+for name, max_bytes in (('no reuse', 0), ('workspace', 256 * 2**20), ('workspace', 512 * 2**20)):
+    ws = Workspace(max_bytes)
+    set_workspace(ws)
+    np.random.seed(0)
+    network = DeepConvNet()
+
+    print("== " + name + " (max_bytes=" + str(max_bytes) + ")")
+    print("%5s %10s %12s %8s %10s %10s %12s %10s" % ("iter", "time(s)", "allocations", "reuses",
+                                                    "evictions", "overflows", "pooled(MB)", "lent(MB)"))
+    total = 0.0
+    for i in range(iters):
+        ws.reset_stats()
+        start = time.perf_counter()
+        network.gradient(x, t)
+        elapsed = time.perf_counter() - start
+        if i > 0:
+            total += elapsed  # 第一次迭代包含初次分配，不计入平均
+        s = ws.stats()
+        print("%5d %10.3f %12d %8d %10d %10d %12.1f %10.1f" % (i, elapsed, s['allocations'], s['reuses'],
+                                                              s['evictions'], s['overflows'],
+                                                              s['pooled_bytes'] / 2**20, s['lent_bytes'] / 2**20))
+    print("mean time (iter 1-%d): %.3f s" % (iters - 1, total / (iters - 1)))
@@ -0,0 +1,206 @@
+# coding: utf-8
+"""激活值检查点（activation checkpointing / recompute-on-backward）
+
+普通的反向传播要求每一层在前向传播时缓存反向传播所需的数据
+（Convolution.col、Relu.mask、Pooling.arg_max 等），这些数据一直保留到反向传播结束。
+检查点的做法是把层分成若干段，前向传播时只保留每段的输入（段边界的激活值），
+段内各层的缓存用完即丢；反向传播到某一段时，从该段的输入重新执行一次前向传播，
+恢复段内各层的缓存后再反向传播。
+
+以多一次前向计算为代价，缓存的峰值从“所有层”降到“边界激活值 + 一段的缓存”。
+
+参考：Chen et al., "Training Deep Nets with Sublinear Memory Cost"
+http://arxiv.org/abs/1604.06174
+"""
+import time
+import numpy as np
+from common.layers import Dropout, BatchNormalization
+from common.workspace import get_workspace
+
+# 各层为反向传播缓存的中间数据（属性名）
+CACHE_ATTRS = ('x', 'col', 'mask', 'arg_max', 'out', 'xn', 'inv_std', 'V', 'X')
+
+
+def segment_starts(num_layers, segments):
+    """根据分段策略求出各段的起始下标
+
+    Parameters
+    ----------
+    num_layers : 层数
+    segments : 分段策略
+        None : 不分段（普通的反向传播）
+        'sqrt' : 分成约 sqrt(层数) 段
+        int : 分成指定数量的等长的段
+        list/tuple : 各段的起始下标（e.g. [5, 10, 15]，0 可以省略）
+
+    Returns
+    -------
+    升序排列的起始下标的列表，第一个元素总是 0
+    """
+    if segments is None:
+        return [0]
+    if isinstance(segments, str):
+        if segments != 'sqrt':
+            raise ValueError("unknown segment policy: " + segments)
+        segments = int(round(np.sqrt(num_layers)))
+    if isinstance(segments, int):
+        segments = max(1, min(segments, num_layers))
+        size = int(np.ceil(num_layers / segments))
+        return list(range(0, num_layers, size))
+
+    return sorted(set([0] + [int(i) for i in segments if 0 < i < num_layers]))
+
+
+def _forward(layer, x):
+    if isinstance(layer, (Dropout, BatchNormalization)):
+        return layer.forward(x, train_flg=True)
+    return layer.forward(x)
+
+
+def release(layers):
+    """丢弃各层为反向传播缓存的中间数据
+
+    col虽然是从workspace借用的，但不归还给workspace：放入池中的数组仍然占用内存，检查点就节省不了内存了。
+    重新计算时再从workspace借用（池中有相同形状的dcol时复用它）。
+    """
+    for layer in layers:
+        for attr in CACHE_ATTRS:
+            if getattr(layer, attr, None) is not None:
+                setattr(layer, attr, None)
+
+
+def cache_nbytes(layers, extra=()):
+    """各层缓存的数据（以及extra中的数组）占用的字节数
+
+    多个属性引用同一块内存（例如 Affine.x 是上一层的输出）时只计算一次。
+    """
+    seen = set()
+    total = 0
+    arrays = [getattr(layer, attr, None) for layer in layers for attr in CACHE_ATTRS]
+    for a in list(arrays) + list(extra):
+        if not isinstance(a, np.ndarray):
+            continue
+        while a.base is not None and isinstance(a.base, np.ndarray):
+            a = a.base
+        if id(a) in seen:
+            continue
+        seen.add(id(a))
+        total += a.nbytes
+    return total
+
+
+def checkpoint_gradient(layers, last_layer, x, t, segments='sqrt', stats=None, start=0):
+    """使用检查点执行前向传播和反向传播
+
+    调用后各层的 dW、db 等梯度与普通的反向传播相同。
+
+    Parameters
+    ----------
+    layers : 层的列表（不含last_layer）
+    last_layer : 损失层（SoftmaxWithLoss）
+    x : 输入数据
+    t : 教师标签
+    segments : 分段策略（参见segment_starts）
+    stats : dict or None
+        传入dict时记录 'peak_bytes'（缓存与workspace池中空闲数组的字节数之和的峰值）、
+        'pool_bytes'（其中池中空闲数组的峰值）、'forward_calls'（层的前向传播次数）
+    start : 反向传播到 layers[start] 为止（参见common/layers.backward_start），
+        完全在它之前的段不再重新计算。反向传播返回None的层（need_dx为False）之前的层
+        无论start的值如何都不再反向传播
+
+    Returns
+    -------
+    损失函数的值
+    """
+    num_layers = len(layers)
+    starts = segment_starts(num_layers, segments)
+    ends = starts[1:] + [num_layers]
+    boundaries = []
+    count = {'forward_calls': 0, 'peak_bytes': 0, 'pool_bytes': 0}
+
+    def track():
+        if stats is not None:
+            # 归还给workspace的数组留在池中，仍然占用内存
+            extra = [b[0] for b in boundaries if b is not None]
+            pooled = get_workspace().pooled_bytes
+            count['peak_bytes'] = max(count['peak_bytes'], cache_nbytes(layers, extra) + pooled)
+            count['pool_bytes'] = max(count['pool_bytes'], pooled)
+
+    def run(s, e, x):
+        for layer in layers[s:e]:
+            x = _forward(layer, x)
+            count['forward_calls'] += 1
+            track()
+        return x
+
+    # forward：只保留各段的输入，最后一段的缓存留给反向传播直接使用
+    for s, e in zip(starts, ends):
+        # Dropout的掩码是随机生成的，重新计算时要恢复段内各Dropout层的随机数状态
+        # （段的第一层是inplace的Relu时x会被改写成relu(x)，ReLU是幂等的，重新计算的结果不变）
+        rng_states = [(l, l.rng.bit_generator.state) for l in layers[s:e] if isinstance(l, Dropout)]
+        boundaries.append((x, rng_states))
+        x = run(s, e, x)
+        if e != num_layers:
+            release(layers[s:e])
+    loss = last_layer.forward(x, t)
+
+    # backward
+    dout = last_layer.backward(1)
+    for i in reversed(range(len(starts))):
+        s, e = starts[i], ends[i]
+        if e <= start or dout is None:
+            break
+        if e != num_layers:
+            x, rng_states = boundaries[i]
+            # 重新计算时不应再次更新BatchNormalization的移动平均
+            bn_stats = [(l, l.running_mean, l.running_var) for l in layers[s:e]
+                        if isinstance(l, BatchNormalization)]
+            cur_states = [(l, l.rng.bit_generator.state) for l, _ in rng_states]
+            for l, state in rng_states:
+                l.rng.bit_generator.state = state
+            run(s, e, x)
+            for l, state in cur_states:
+                l.rng.bit_generator.state = state
+            for l, mean, var in bn_stats:
+                l.running_mean, l.running_var = mean, var
+
+        for layer in reversed(layers[max(s, start):e]):
+            dout = layer.backward(dout)
+            track()
+            if dout is None:  # 不计算输入梯度的层（网络的第一个有参数的层等）
+                break
+        release(layers[s:e])
+        boundaries[i] = None
+
+    if stats is not None:
+        stats.update(count)
+    return loss
+
+
+def checkpoint_report(layers, last_layer, x, t, segments='sqrt', repeat=3, start=0):
+    """比较普通的反向传播与检查点的缓存峰值和计算时间
+
+    start 与checkpoint_gradient相同（网络的 backward_start）
+
+    Returns
+    -------
+    dict : 'baseline_peak_bytes', 'checkpoint_peak_bytes', 'saved_bytes',
+           'baseline_pool_bytes', 'checkpoint_pool_bytes'（peak_bytes中workspace池的部分）,
+           'baseline_time', 'checkpoint_time', 'extra_forward_calls', 'time_ratio'
+    """
+    result = {}
+    for name, policy in (('baseline', None), ('checkpoint', segments)):
+        stats = {}
+        checkpoint_gradient(layers, last_layer, x, t, policy, stats, start)
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            checkpoint_gradient(layers, last_layer, x, t, policy, start=start)
+        result[name + '_time'] = (time.perf_counter() - begin) / repeat
+        result[name + '_peak_bytes'] = stats['peak_bytes']
+        result[name + '_pool_bytes'] = stats['pool_bytes']
+        result[name + '_forward_calls'] = stats['forward_calls']
+
+    result['saved_bytes'] = result['baseline_peak_bytes'] - result['checkpoint_peak_bytes']
+    result['extra_forward_calls'] = result['checkpoint_forward_calls'] - result['baseline_forward_calls']
+    result['time_ratio'] = result['checkpoint_time'] / result['baseline_time']
+    return result
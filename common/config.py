@@ -0,0 +1,33 @@
+# coding: utf-8
+"""计算使用的浮点数类型（dtype）的全局设置
+
+默认是 np.float64（与书中的代码相同，数值微分的梯度确认也在float64下进行）。
+训练时可以切换成 np.float32，内存和内存带宽减半，矩阵乘法也更快：
+
+    from common.config import set_default_dtype
+    set_default_dtype(np.float32)
+    network = DeepConvNet()   # 参数以float32初始化，输入在predict时转换为float32
+
+网络类在生成时读取该设置（之后修改不影响已经生成的网络），
+参数的初始化、load_params 读入的参数、predict 的输入都转换为该类型。
+各层（common/layers.py）和 im2col/col2im 按输入的dtype分配缓冲区，优化器按参数的dtype
+保存动量等状态，所以参数和输入的类型一致时不会在中途被提升为float64。
+"""
+import numpy as np
+
+_default_dtype = np.dtype(np.float64)
+
+
+def get_default_dtype():
+    """网络的参数和输入使用的dtype"""
+    return _default_dtype
+
+
+def set_default_dtype(dtype):
+    """设定网络的参数和输入使用的dtype（np.float32 或 np.float64），返回原来的设定"""
+    global _default_dtype
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError("dtype must be float32 or float64, got " + str(dtype))
+    old, _default_dtype = _default_dtype, dtype
+    return old
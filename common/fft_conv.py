@@ -0,0 +1,128 @@
+# coding: utf-8
+"""基于 FFT 的卷积（numpy.fft）
+
+卷积层实际计算的是互相关：
+    y[n, f] = sum_c corr(x_pad[n, c], W[f, c])
+在频域里变成逐频率的乘法，对通道的求和变成每个频率上的一次矩阵乘法：
+    Y[n, f] = sum_c X[n, c] * conj(Wf[f, c])
+FFT 的尺寸取 padding 后的图像大小 (Hp, Wp)。有效输出的下标不会越过边界，
+所以循环卷积的结果就是线性卷积的结果，不需要再额外补零。
+
+计算量与滤波器大小 FH*FW 基本无关，因此适合大滤波器或大图像；
+通道数少的小滤波器（例如输入层的 3x3、5x5）仍然是 im2col 更快（参见 fft_is_faster）。
+
+NumPy 1.x 的 np.fft 总是返回 complex128/float64，输出和梯度在最后转换回输入的dtype
+（float32 的学习不会被提升为 float64；NumPy 2 中 float32 的输入本来就保持 complex64/float32）。
+"""
+import numpy as np
+
+# fft_is_faster 中的经验系数：FFT 路径的计算量乘以该系数后与 im2col 比较
+# 由 chapter8/fft_conv_compare.py 的实测（前向+反向传播）求出：MNIST各层和64x64、128x128图像上
+# 合计时间最小的范围约为 0.7 ~ 1.4，取 1.0。环境（BLAS、FFT的实现）不同时可以用该脚本重新求
+FFT_OVERHEAD = 1.0
+
+
+def fft_cost_ratio(x_shape, W_shape, stride=1, pad=0):
+    """FFT 路径与 im2col 的计算量之比（乘以 FFT_OVERHEAD 之前）
+
+    im2col : N*FN*C*out_h*out_w*FH*FW 次乘加
+    FFT    : 频域乘法 4*N*FN*C*Hp*(Wp/2+1) 次实数乘加，
+             加上 (N*C + FN*C + N*FN) 次 Hp*Wp 点的 FFT
+    滤波器相对于图像越大，比值越小（FFT 越有利）。
+    """
+    N, C, H, W = x_shape
+    FN, C, FH, FW = W_shape
+    Hp, Wp = H + 2*pad, W + 2*pad
+    out_h = (Hp - FH) // stride + 1
+    out_w = (Wp - FW) // stride + 1
+
+    direct = float(N * FN * C) * out_h * out_w * FH * FW
+    fft_size = Hp * Wp
+    fft = 4.0 * N * FN * C * Hp * (Wp // 2 + 1) \
+        + 2.5 * (N*C + FN*C + N*FN) * fft_size * np.log2(fft_size)
+
+    return fft / direct
+
+
+def fft_is_faster(x_shape, W_shape, stride=1, pad=0):
+    """根据计算量粗略判断 FFT 卷积是否比 im2col 更快（参见fft_cost_ratio）"""
+    return FFT_OVERHEAD * fft_cost_ratio(x_shape, W_shape, stride, pad) < 1.0
+
+
+def _freq_matmul(a, b):
+    """a (N, K, Hf, Wf) 与 b (K, M, Hf, Wf) 在每个频率上做矩阵乘法，结果 (N, M, Hf, Wf)"""
+    Hf, Wf = a.shape[2:]
+    a = a.transpose(2, 3, 0, 1).reshape(Hf * Wf, a.shape[0], a.shape[1])
+    b = b.transpose(2, 3, 0, 1).reshape(Hf * Wf, b.shape[0], b.shape[1])
+    c = np.matmul(a, b)
+    return c.reshape(Hf, Wf, c.shape[1], c.shape[2]).transpose(2, 3, 0, 1)
+
+
+def filter_transform(W, fft_shape):
+    """滤波器的频域表示 (FN, C, Hp, Wp//2+1)，补零到 fft_shape"""
+    return np.fft.rfft2(W, s=fft_shape)
+
+
+def conv_forward(x, Wf, b, filter_shape, stride=1, pad=0):
+    """FFT 卷积的前向传播
+
+    Parameters
+    ----------
+    x : 输入 (N, C, H, W)
+    Wf : filter_transform 的结果
+    b : 偏置 (FN,)
+    filter_shape : (FH, FW)
+
+    Returns
+    -------
+    out : (N, FN, out_h, out_w)
+    X : 输入的频域表示，反向传播时使用
+    """
+    FH, FW = filter_shape
+    img = x
+    if pad > 0:
+        img = np.pad(x, [(0, 0), (0, 0), (pad, pad), (pad, pad)], mode='constant')
+    Hp, Wp = img.shape[2:]
+
+    X = np.fft.rfft2(img)
+    Y = _freq_matmul(X, Wf.conj().transpose(1, 0, 2, 3))
+    y = np.fft.irfft2(Y, s=(Hp, Wp))
+
+    out = y[:, :, :Hp - FH + 1:stride, :Wp - FW + 1:stride] + b.reshape(1, -1, 1, 1)
+    return out.astype(x.dtype, copy=False), X
+
+
+def conv_backward(dout, Wf, X, x_shape, filter_shape, stride=1, pad=0, need_dx=True):
+    """FFT 卷积的反向传播
+
+    Returns
+    -------
+    dx : (N, C, H, W)，need_dx为False时为None（不计算）
+    dW : (FN, C, FH, FW)
+    db : (FN,)
+    """
+    N, C, H, W = x_shape
+    FH, FW = filter_shape
+    Hp, Wp = H + 2*pad, W + 2*pad
+    dtype = dout.dtype  # dW、dx与dout（网络的dtype）一致
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    # 步幅大于1时，把dout放回步幅1的输出网格上（其余位置为0）
+    if stride != 1:
+        dy = np.zeros(dout.shape[:2] + (Hp - FH + 1, Wp - FW + 1), dtype=dout.dtype)
+        dy[:, :, ::stride, ::stride] = dout
+        dout = dy
+    DY = np.fft.rfft2(dout, s=(Hp, Wp))
+
+    # dW[f, c] = sum_n corr(x_pad[n, c], dy[n, f])
+    dW = np.fft.irfft2(_freq_matmul(DY.conj().transpose(1, 0, 2, 3), X), s=(Hp, Wp))
+    dW = dW[:, :, :FH, :FW].astype(dtype, copy=False)
+    if not need_dx:
+        return None, dW, db
+
+    # dx_pad[n, c] = sum_f conv(dy[n, f], W[f, c])
+    dx = np.fft.irfft2(_freq_matmul(DY, Wf), s=(Hp, Wp))
+    dx = dx[:, :, pad:H + pad, pad:W + pad].astype(dtype, copy=False)
+
+    return dx, dW, db
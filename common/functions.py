@@ -29,14 +29,10 @@ def relu_grad(x):
     
 
 def softmax(x):
-    if x.ndim == 2:
-        x = x.T
-        x = x - np.max(x, axis=0)
-        y = np.exp(x) / np.sum(np.exp(x), axis=0)
-        return y.T 
-
-    x = x - np.max(x) # 溢出对策
-    return np.exp(x) / np.sum(np.exp(x))
+    x = x - np.max(x, axis=-1, keepdims=True) # 溢出对策
+    y = np.exp(x)
+    y /= np.sum(y, axis=-1, keepdims=True)
+    return y
 
 
 def mean_squared_error(y, t):
@@ -64,6 +60,38 @@ def cross_entropy_error(y, t):
     return -np.sum(np.log(y[np.arange(batch_size), t] + 1e-7)) / batch_size
 
 
+def softmax_cross_entropy(x, t):
+    """
+    直接由logits计算softmax + 交叉熵误差（log-sum-exp）
+        loss = mean(logsumexp(x) - x[t])
+    不需要先求出概率再取对数，所以也不需要 1e-7 这样的修正项
+    参数:
+        x: logits，形状为(batch_size, num_classes)或(num_classes,)
+        t: 监督标签，可以是one-hot向量（也可以是概率分布）或标签索引
+    返回值:
+        tuple: (批次的平均交叉熵误差, softmax的输出（与x的形状相同）)
+    """
+    x_shape = x.shape
+    if x.ndim == 1:
+        t = t.reshape(1, t.size)
+        x = x.reshape(1, x.size)
+
+    m = np.max(x, axis=1, keepdims=True)
+    y = x - m
+    np.exp(y, out=y)
+    s = np.sum(y, axis=1, keepdims=True)
+    lse = (np.log(s) + m).ravel()
+
+    batch_size = x.shape[0]
+    if t.size == x.size:
+        # sum(t * (lse - x))，每一行的t之和为1时就是 lse - x[t]
+        loss = np.dot(t.sum(axis=1), lse) - np.einsum('ij,ij->', t, x)
+    else:
+        loss = np.sum(lse) - np.sum(x[np.arange(batch_size), t])
+
+    y /= s
+    return loss / batch_size, y.reshape(x_shape)
+
+
 def softmax_loss(X, t):
-    y = softmax(X)
-    return cross_entropy_error(y, t)
+    return softmax_cross_entropy(X, t)[0]
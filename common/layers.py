@@ -1,25 +1,166 @@
 # coding: utf-8
 import numpy as np
 from common.functions import *
-from common.util import im2col, col2im
+from common.util import im2col_strided, col2im_buffered
+from common import winograd, fft_conv
+from common.workspace import get_workspace
+from common.parallel import run_shards, run_concurrently
+
+
+def _buffer(buf, shape, dtype):
+    """把上一次借用的buf还给workspace，再借用 (shape, dtype) 的缓冲区（通常就是buf本身）"""
+    ws = get_workspace()
+    ws.give_back(buf)
+    return ws.borrow(shape, dtype)
+
+
+def _padded_buffer(buf, input_shape, pad, dtype, layout='NCHW'):
+    """返回col2im_buffered使用的 (N, H+2*pad, W+2*pad, C) 缓冲区，参见_buffer"""
+    if layout == 'NHWC':
+        N, H, W, C = input_shape
+    else:
+        N, C, H, W = input_shape
+    return _buffer(buf, (N, H + 2*pad, W + 2*pad, C), dtype)
+
+
+def _reuse(buf, shape, dtype):
+    """buf的形状和dtype一致时直接返回buf，否则新分配（层自己持有、不经过workspace的梯度缓冲区）"""
+    if buf is not None and buf.shape == tuple(shape) and buf.dtype == dtype:
+        return buf
+    return np.empty(shape, dtype=dtype)
+
+
+def _output(layer, shape, dtype):
+    """前向传播的输出数组
+
+    layer.out_buf（common/memory_planner.py在arena中分配的区域）的元素数和dtype一致时
+    返回它的视图，否则新分配
+    """
+    buf = layer.out_buf
+    if buf is not None and buf.size == int(np.prod(shape)) and buf.dtype == dtype:
+        return buf.reshape(shape)
+    return np.empty(shape, dtype=dtype)
+
+
+def backward_start(layers, frozen=0):
+    """设定各层的need_dx，返回反向传播需要经过的第一层的下标
+
+    有参数的层（Affine、Convolution、BatchNormalization，即有need_dx属性的层）中，
+    前frozen个被冻结（不计算梯度，BatchNormalization的frozen设为True），
+    其后第一个有参数的层的输入梯度不再被使用，need_dx设为False。
+    反向传播到该层为止，之前的层不再调用backward。
+    所有有参数的层都被冻结时返回len(layers)（不需要反向传播）。
+    """
+    idxs = [i for i, layer in enumerate(layers) if hasattr(layer, 'need_dx')]
+    for n, i in enumerate(idxs):
+        layers[i].need_dx = True
+        if hasattr(layers[i], 'frozen'):
+            layers[i].frozen = n < frozen  # 被冻结的BatchNormalization不再更新移动平均
+    if frozen >= len(idxs):
+        return len(layers)
+    layers[idxs[frozen]].need_dx = False
+    return idxs[frozen]
+
+
+def _padded_shape(x_shape, pad, layout='NCHW'):
+    if layout == 'NHWC':
+        N, H, W, C = x_shape
+        return (N, H + 2*pad, W + 2*pad, C)
+    N, C, H, W = x_shape
+    return (N, C, H + 2*pad, W + 2*pad)
+
+
+def _pad_into(img, x, pad, layout='NCHW'):
+    """在img中写入在高、宽方向四周补pad个0的x"""
+    if layout == 'NHWC':
+        H, W = x.shape[1:3]
+        rows = img[:, pad:H + pad]
+        img[:, :pad] = 0
+        img[:, H + pad:] = 0
+        rows[:, :, :pad] = 0
+        rows[:, :, W + pad:] = 0
+        rows[:, :, pad:W + pad] = x
+    else:
+        H, W = x.shape[2:]
+        rows = img[:, :, pad:H + pad]
+        img[:, :, :pad] = 0
+        img[:, :, H + pad:] = 0
+        rows[:, :, :, :pad] = 0
+        rows[:, :, :, W + pad:] = 0
+        rows[:, :, :, pad:W + pad] = x
+    return img
+
+
+def _pool_windows(x, pool_h, pool_w, layout='NCHW', writeable=False):
+    """步幅等于窗口大小（窗口互不重叠）时的窗口视图
+
+    返回函数win，win(k) 是各窗口内第 k 个元素（k = y*pool_w + x）组成的视图，
+    形状与池化的输出相同。图像的高、宽不能被窗口整除时，多出的行/列不属于任何窗口。
+    """
+    if layout == 'NHWC':
+        N, H, W, C = x.shape
+        sN, sH, sW, sC = x.strides
+        shape = (N, pool_h, pool_w, H // pool_h, W // pool_w, C)
+        strides = (sN, sH, sW, sH * pool_h, sW * pool_w, sC)
+    else:
+        N, C, H, W = x.shape
+        sN, sC, sH, sW = x.strides
+        shape = (N, C, pool_h, pool_w, H // pool_h, W // pool_w)
+        strides = (sN, sC, sH, sW, sH * pool_h, sW * pool_w)
+    view = np.lib.stride_tricks.as_strided(x, shape=shape, strides=strides, writeable=writeable)
+
+    if layout == 'NHWC':
+        return lambda k: view[:, k // pool_w, k % pool_w]
+    return lambda k: view[:, :, k // pool_w, k % pool_w]
+
+
+def _window_max(win, pool_size, out=None):
+    """各窗口的最大值（写入out），以及最大值在窗口内的位置（uint8）"""
+    if out is None:
+        out = win(0).copy()
+    else:
+        np.copyto(out, win(0))
+    arg_max = np.zeros(out.shape, dtype=np.uint8)
+    for k in range(1, pool_size):
+        v = win(k)
+        mask = v > out  # 与np.argmax一样，相同的最大值取第一个
+        np.copyto(out, v, where=mask)
+        np.copyto(arg_max, k, where=mask)
+    return out, arg_max
+
+
+def _window_scatter(win, dout, arg_max, pool_size):
+    """把dout写回各窗口中最大值的位置，其余位置为0"""
+    for k in range(pool_size):
+        np.multiply(dout, arg_max == k, out=win(k))
 
 
 class Relu:
-    def __init__(self):
+    """ReLU层
+
+    inplace : 为True时直接把结果写入输入x，不复制（默认False）
+        只能用于x在之后不再被使用的情况，例如x是Affine、Convolution、BatchNormalization
+        新生成的输出。网络类在这些层之后自动使用inplace=True
+    掩码（x > 0）按位压缩保存（np.packbits），是布尔数组的1/8。
+    反向传播不修改dout，返回新的数组。
+    """
+    def __init__(self, inplace=False):
+        self.inplace = inplace
         self.mask = None
+        self.out_buf = None
 
     def forward(self, x):
         # 前向传播，将小于等于0的元素置为0
-        self.mask = (x <= 0)
-        out = x.copy()
-        out[self.mask] = 0
+        self.mask = np.packbits(x > 0, axis=None)
+        if self.inplace:
+            return np.maximum(x, 0, out=x)
 
-        return out
+        return np.maximum(x, 0, out=_output(self, x.shape, x.dtype))
 
     def backward(self, dout):
         # 反向传播，小于等于0的元素的梯度为0
-        dout[self.mask] = 0
-        dx = dout
+        mask = np.unpackbits(self.mask, count=dout.size).view(bool).reshape(dout.shape)
+        dx = dout * mask
 
         return dx
 
@@ -27,10 +168,14 @@ class Relu:
 class Sigmoid:
     def __init__(self):
         self.out = None
+        self.out_buf = None
 
     def forward(self, x):
-        # 前向传播，计算sigmoid激活
-        out = sigmoid(x)
+        # 前向传播，计算sigmoid激活：1 / (1 + exp(-x))
+        out = np.negative(x, out=_output(self, x.shape, x.dtype))
+        np.exp(out, out=out)
+        out += 1
+        np.reciprocal(out, out=out)
         self.out = out
         return out
 
@@ -42,15 +187,28 @@ class Sigmoid:
 
 
 class Affine:
-    def __init__(self, W, b):
+    """全连接层
+
+    dW、db、dx写入层持有的缓冲区，输入的形状不变时反向传播不再分配内存。
+    下一次反向传播会覆盖上一次的梯度，需要保留时由调用方复制。
+    need_dx为False时（网络的输入层）反向传播只计算dW、db，返回None。
+
+    parallel_backward为True时反向传播的 dx = dout·Wᵀ 和 dW = xᵀ·dout 两个矩阵乘法
+    在两个线程中同时执行（参见common/parallel.run_concurrently），结果与False时完全相同。
+    """
+    def __init__(self, W, b, parallel_backward=False):
         self.W = W
         self.b = b
+        self.parallel_backward = parallel_backward
         
         self.x = None
         self.original_x_shape = None
         # 权重和偏置参数的导数
         self.dW = None
         self.db = None
+        self._dx_buf = None
+        self.out_buf = None
+        self.need_dx = True
 
     def forward(self, x):
         # 前向传播，计算仿射变换
@@ -59,20 +217,79 @@ class Affine:
         x = x.reshape(x.shape[0], -1)
         self.x = x
 
-        out = np.dot(self.x, self.W) + self.b
+        out = np.dot(self.x, self.W, out=_output(self, (x.shape[0], self.W.shape[1]), np.result_type(x, self.W)))
+        out += self.b
 
         return out
 
     def backward(self, dout):
-        # 反向传播，计算仿射变换的梯度
-        dx = np.dot(dout, self.W.T)
-        self.dW = np.dot(self.x.T, dout)
-        self.db = np.sum(dout, axis=0)
-        
+        # 反向传播，计算仿射变换的梯度（写入持有的缓冲区）
+        self.dW = _reuse(self.dW, self.W.shape, np.result_type(self.x, dout))
+        self.db = _reuse(self.db, self.b.shape, dout.dtype)
+
+        def param_grad():
+            np.dot(self.x.T, dout, out=self.dW)
+            np.sum(dout, axis=0, out=self.db)
+
+        if not self.need_dx:
+            param_grad()
+            return None
+
+        self._dx_buf = _reuse(self._dx_buf, self.x.shape, np.result_type(dout, self.W))
+
+        def input_grad():
+            return np.dot(dout, self.W.T, out=self._dx_buf)
+
+        if self.parallel_backward:
+            dx, _ = run_concurrently(input_grad, param_grad)
+        else:
+            param_grad()
+            dx = input_grad()
         dx = dx.reshape(*self.original_x_shape)  # 还原输入数据的形状（对应张量）
         return dx
 
 
+class AffineActivation(Affine):
+    """Affine → 激活函数（'relu' 或 'sigmoid'）的融合层
+
+    在矩阵乘法的输出上原地加偏置、计算激活函数，不生成单独的激活层的输出和掩码；
+    反向传播只使用激活后的输出out（ReLU：out > 0，Sigmoid：out * (1 - out)）和Affine的输入x。
+    结果与 Affine → Relu/Sigmoid 相同。dW、db、dx的缓冲区、need_dx、parallel_backward 与Affine相同。
+    """
+    def __init__(self, W, b, activation='relu', parallel_backward=False):
+        if activation not in ('relu', 'sigmoid'):
+            raise ValueError("unknown activation: " + str(activation))
+        super().__init__(W, b, parallel_backward)
+        self.activation = activation
+        self.out = None
+        self._dz_buf = None
+
+    def forward(self, x):
+        out = super().forward(x)
+        if self.activation == 'relu':
+            np.maximum(out, 0, out=out)
+        else:
+            np.negative(out, out=out)
+            np.exp(out, out=out)
+            out += 1
+            np.reciprocal(out, out=out)
+        self.out = out
+
+        return out
+
+    def backward(self, dout):
+        # 激活函数的梯度写入持有的缓冲区（不改写dout），再计算Affine的梯度
+        self._dz_buf = dz = _reuse(self._dz_buf, self.out.shape, np.result_type(dout, self.out))
+        if self.activation == 'relu':
+            np.multiply(dout, self.out > 0, out=dz)
+        else:
+            np.subtract(1.0, self.out, out=dz)
+            np.multiply(dout, dz, out=dz)
+            dz *= self.out
+
+        return super().backward(dz)
+
+
 class SoftmaxWithLoss:
     def __init__(self):
         self.loss = None # 损失
@@ -80,22 +297,23 @@ class SoftmaxWithLoss:
         self.t = None # 监督数据
 
     def forward(self, x, t):
-        # 前向传播，计算softmax的损失
+        # 前向传播，由logits直接计算损失（log-sum-exp），exp的缓冲区同时作为softmax的输出保留
+        if t.size == x.size: # one-hot-vector与x的dtype一致，避免dx被提升为float64
+            t = t.astype(x.dtype, copy=False)
         self.t = t
-        self.y = softmax(x)
-        self.loss = cross_entropy_error(self.y, self.t)
+        self.loss, self.y = softmax_cross_entropy(x, t)
         
         return self.loss
 
     def backward(self, dout=1):
         # 反向传播，计算softmax的梯度
         batch_size = self.t.shape[0]
+        scale = dout / batch_size
         if self.t.size == self.y.size: # 监督数据是one-hot-vector的情况
-            dx = (self.y - self.t) / batch_size
+            dx = (self.y - self.t) * scale
         else:
-            dx = self.y.copy()
-            dx[np.arange(batch_size), self.t] -= 1
-            dx = dx / batch_size
+            dx = self.y * scale
+            dx[np.arange(batch_size), self.t] -= scale
         
         return dx
 
@@ -103,32 +321,87 @@ class SoftmaxWithLoss:
 class Dropout:
     """
     http://arxiv.org/abs/1207.0580
+
+    Inverted dropout：学习时保留的元素乘以 1/(1 - dropout_ratio)，
+    推理时直接返回x，不做任何计算。
+    掩码由本层的np.random.Generator直接生成随机比特，按位压缩保存（每个元素1比特）。
+
+    Parameters
+    ----------
+    dropout_ratio : 丢弃的比例
+        0.5时每个随机比特直接作为掩码；其他值时用16位的随机整数与阈值比较，
+        比例按 1/65536 取整
+    seed : 随机数的种子
+        None时从np.random取得种子，所以调用np.random.seed()之后结果也是可重现的
     """
-    def __init__(self, dropout_ratio=0.5):
+    def __init__(self, dropout_ratio=0.5, seed=None):
         self.dropout_ratio = dropout_ratio
+        if seed is None:
+            seed = np.random.randint(2**31)
+        self.rng = np.random.default_rng(seed)
+        self.scale = 1.0 / (1.0 - dropout_ratio) if dropout_ratio < 1.0 else 0.0
         self.mask = None
+        self.out_buf = None
+
+    def _draw_mask(self, size):
+        """size个元素的掩码（1为保留），按位压缩为uint8数组"""
+        if self.dropout_ratio == 0.5:
+            return np.frombuffer(self.rng.bytes((size + 7) // 8), dtype=np.uint8)
+        threshold = int(round(self.dropout_ratio * 65536))
+        return np.packbits(self.rng.integers(0, 65536, size, dtype=np.uint16) >= threshold)
+
+    def _unpack_mask(self, shape):
+        return np.unpackbits(self.mask, count=int(np.prod(shape))).view(bool).reshape(shape)
 
     def forward(self, x, train_flg=True):
         # 前向传播，根据训练标志决定是否执行dropout
-        if train_flg:
-            self.mask = np.random.rand(*x.shape) > self.dropout_ratio
-            return x * self.mask
-        else:
-            return x * (1.0 - self.dropout_ratio)
+        if not train_flg:
+            return x
+
+        self.mask = self._draw_mask(x.size)
+        out = np.multiply(x, self._unpack_mask(x.shape), out=_output(self, x.shape, x.dtype))
+        out *= self.scale
+        return out
 
     def backward(self, dout):
         # 反向传播，计算dropout的梯度
-        return dout * self.mask
+        dx = dout * self._unpack_mask(dout.shape)
+        dx *= self.scale
+        return dx
 
 
 class BatchNormalization:
     """
     http://arxiv.org/abs/1502.03167
+
+    layout : 4维输入的数据排列，'NCHW'（默认）或 'NHWC'
+        4维输入会展开为 (N, C*H*W) 对每个元素归一化，NHWC时gamma、beta、
+        running_mean、running_var 按 (H, W, C) 的顺序排列
+    spatial : 为True时4维输入按通道归一化（卷积层之后的BN）
+        均值和方差对 N、H、W 求出，gamma、beta、running_mean、running_var 的形状为 (C,)。
+        与spatial=False时一样按内存的顺序展开为 (N, C*H*W)（不复制输入，各行足够长，广播很快），
+        各列的和按通道合计，各通道的参数按列展开（NCHW为repeat，NHWC及内存按NHWC排列的
+        NCHW输入（例如im2col卷积层的输出）为tile）后再广播
+    dtype : 计算使用的数据类型（None表示与输入相同，e.g. np.float32）
+        指定时输入、xn、输出和梯度都使用该类型
+    eps : 方差上加的小的值（防止除以0）
+
+    学习时均值和方差由一次遍历求出的 sum(x)、sum(x*x) 计算，不生成 x - mu、(x - mu)**2
+    等临时数组；反向传播只需要 xn 和 1/std（inv_std），用两次求和的闭式计算梯度。
+    均值相对于标准差非常大时，sum(x*x)/N - mu**2 会损失有效数字（float32时更明显）。
+    need_dx为False时反向传播只计算dgamma、dbeta，返回None。
+    frozen为True时（网络的freeze_prefix冻结了该层，参见backward_start）即使train_flg为True
+    也按推理时的方式使用running_mean、running_var归一化，不再更新它们。
     """
-    def __init__(self, gamma, beta, momentum=0.9, running_mean=None, running_var=None):
+    def __init__(self, gamma, beta, momentum=0.9, running_mean=None, running_var=None, layout='NCHW',
+                 dtype=None, eps=10e-7, spatial=False):
         self.gamma = gamma
         self.beta = beta
         self.momentum = momentum
+        self.layout = layout
+        self.spatial = spatial
+        self.dtype = dtype
+        self.eps = eps
         self.input_shape = None # Conv层的情况下为4维，全连接层的情况下为2维  
 
         # 测试时使用的平均值和方差
@@ -136,167 +409,825 @@ class BatchNormalization:
         self.running_var = running_var  
         
         # backward时使用的中间数据
-        self.batch_size = None
-        self.xc = None
-        self.std = None
+        self.xn = None
+        self.inv_std = None
+        self._channels_last = False  # 前向传播时决定的展开方式（参见_as_rows）
+        self._group = 1
         self.dgamma = None
         self.dbeta = None
+        self.out_buf = None
+        self.need_dx = True
+        self.frozen = False
 
     def forward(self, x, train_flg=True):
-        # 前向传播，根据训练标志决定是否执行批量归一化
+        # 前向传播，根据训练标志决定是否执行批量归一化（被冻结的层总是使用移动平均）
+        train_flg = train_flg and not self.frozen
         self.input_shape = x.shape
-        if x.ndim != 2:
-            N, C, H, W = x.shape
-            x = x.reshape(N, -1)
+        spatial = x.ndim == 4 and self.spatial
+        self._channels_last = spatial and (self.layout == 'NHWC' or x.transpose(0, 2, 3, 1).flags.c_contiguous)
+        self._group = 1  # 每个通道占的列数（spatial时为H*W）
+        if spatial:
+            self._group = x.shape[1] * x.shape[2] if self.layout == 'NHWC' else x.shape[2] * x.shape[3]
+        x = self._as_rows(x)
+        if self.dtype is not None:
+            x = x.astype(self.dtype, copy=False)
 
         out = self.__forward(x, train_flg)
         
-        return out.reshape(*self.input_shape)
-            
+        return self._from_rows(out)
+
+    def _as_rows(self, x):
+        """按内存的顺序展开为 (N, D)，各列对第0轴归一化"""
+        if self._channels_last and self.layout == 'NCHW':
+            x = x.transpose(0, 2, 3, 1)
+        return x.reshape(x.shape[0], -1)
+
+    def _from_rows(self, a):
+        """_as_rows的逆变换"""
+        if self._channels_last and self.layout == 'NCHW':
+            N, C, H, W = self.input_shape
+            return a.reshape(N, H, W, C).transpose(0, 3, 1, 2)
+        return a.reshape(*self.input_shape)
+
+    def _pool(self, v):
+        """各列的和合计为各通道的和（spatial时，每个通道有H*W列）"""
+        if self._group == 1:
+            return v
+        if self._channels_last:
+            return v.reshape(self._group, -1).sum(axis=0)
+        return v.reshape(-1, self._group).sum(axis=1)
+
+    def _expand(self, v):
+        """各通道的值展开为各列的值（_pool的反方向）"""
+        if self._group == 1:
+            return v
+        if self._channels_last:
+            return np.tile(v, self._group)
+        return np.repeat(v, self._group)
+
     def __forward(self, x, train_flg):
         # 实际执行批量归一化的前向传播
         if self.running_mean is None:
-            N, D = x.shape
-            self.running_mean = np.zeros(D)
-            self.running_var = np.zeros(D)
+            D = x.shape[1] // self._group
+            self.running_mean = np.zeros(D, dtype=x.dtype)
+            self.running_var = np.zeros(D, dtype=x.dtype)
+        gamma = self._expand(self.gamma.astype(x.dtype, copy=False))
+        beta = self._expand(self.beta.astype(x.dtype, copy=False))
                         
         if train_flg:
-            mu = x.mean(axis=0)
-            xc = x - mu
-            var = np.mean(xc**2, axis=0)
-            std = np.sqrt(var + 10e-7)
-            xn = xc / std
+            M = x.shape[0] * self._group  # 每个元素（spatial时为每个通道）参与归一化的个数
+            mu = self._pool(x.sum(axis=0)) / M
+            var = self._pool(np.einsum('nd,nd->d', x, x)) / M - mu * mu
+            np.maximum(var, 0, out=var)  # 舍入误差可能使方差略小于0
+            inv_std = 1.0 / np.sqrt(var + self.eps)
+
+            xn = x - self._expand(mu)
+            xn *= self._expand(inv_std)
             
-            self.batch_size = x.shape[0]
-            self.xc = xc
             self.xn = xn
-            self.std = std
+            self.inv_std = inv_std
             self.running_mean = self.momentum * self.running_mean + (1-self.momentum) * mu
             self.running_var = self.momentum * self.running_var + (1-self.momentum) * var            
+            
+            out = np.multiply(xn, gamma, out=_output(self, x.shape, x.dtype))
+            out += beta
         else:
-            xc = x - self.running_mean
-            xn = xc / ((np.sqrt(self.running_var + 10e-7)))
+            # 推理时归一化和缩放合并为一次乘法和一次加法
+            scale = (self.gamma / np.sqrt(self.running_var + self.eps)).astype(x.dtype, copy=False)
+            shift = (self.beta - self.running_mean * scale).astype(x.dtype, copy=False)
+            out = np.multiply(x, self._expand(scale), out=_output(self, x.shape, x.dtype))
+            out += self._expand(shift)
             
-        out = self.gamma * xn + self.beta 
         return out
 
     def backward(self, dout):
         # 反向传播，计算批量归一化的梯度
-        if dout.ndim != 2:
-            N, C, H, W = dout.shape
-            dout = dout.reshape(N, -1)
+        dout = self._as_rows(dout)
+        if self.dtype is not None:
+            dout = dout.astype(self.dtype, copy=False)
 
         dx = self.__backward(dout)
+        if dx is None:
+            return None
 
-        dx = dx.reshape(*self.input_shape)
-        return dx
+        return self._from_rows(dx)
 
     def __backward(self, dout):
         # 实际执行批量归一化的反向传播
-        dbeta = dout.sum(axis=0)
-        dgamma = np.sum(self.xn * dout, axis=0)
-        dxn = self.gamma * dout
-        dxc = dxn / self.std
-        dstd = -np.sum((dxn * self.xc) / (self.std * self.std), axis=0)
-        dvar = 0.5 * dstd / self.std
-        dxc += (2.0 / self.batch_size) * self.xc * dvar
-        dmu = np.sum(dxc, axis=0)
-        dx = dxc - dmu / self.batch_size
-        
+        # dx = gamma * inv_std * (dout - dbeta/M - xn * dgamma/M)
+        M = dout.shape[0] * self._group
+        xn = self.xn
+        dbeta = self._pool(dout.sum(axis=0))
+        dgamma = self._pool(np.einsum('nd,nd->d', xn, dout))
         self.dgamma = dgamma
         self.dbeta = dbeta
+        if not self.need_dx:
+            return None
+
+        dx = xn * self._expand(-dgamma / M)
+        dx -= self._expand(dbeta / M)
+        dx += dout
+        dx *= self._expand((self.gamma * self.inv_std).astype(dx.dtype, copy=False))
         
         return dx
 
 
+class Transpose:
+    """交换轴的层（e.g. 在网络的输入处把NCHW转换为NHWC）"""
+    def __init__(self, axes):
+        self.axes = tuple(axes)
+        self.inv_axes = tuple(np.argsort(axes))
+
+    def forward(self, x):
+        return x.transpose(self.axes)
+
+    def backward(self, dout):
+        return dout.transpose(self.inv_axes)
+
+
 class Convolution:
-    def __init__(self, W, b, stride=1, pad=0):
+    """卷积层
+
+    Parameters
+    ----------
+    W : 滤波器 (FN, C/groups, FH, FW)
+    b : 偏置 (FN,)
+    stride : 步幅
+    pad : 填充
+    algo : 卷积的计算方式
+        'im2col' : im2col + 矩阵乘法（默认）
+        'winograd' : Winograd F(2x2, 3x3)，仅限 3x3 滤波器、步幅 1（参见 common/winograd.py）
+        'fft' : FFT卷积，适合大滤波器、大图像（参见 common/fft_conv.py）
+        'auto' : 每次前向传播时根据输入大小在 'im2col' 和 'fft' 之间选择
+    layout : 输入输出的数据排列，'NCHW'（默认）或 'NHWC'（通道在最后）
+        NHWC时GEMM的结果不需要转置就是输出，反向传播也不需要转置dout；
+        只支持algo='im2col'。W的形状不论哪种排列都是 (FN, C/groups, FH, FW)
+    groups : 分组卷积的组数（默认1）
+        输入通道和滤波器各分成groups组，第g组的滤波器只与第g组的输入通道卷积，
+        参数量和计算量都是普通卷积的1/groups；groups == C（且FN为C的倍数）时为depthwise卷积。
+        各组的矩阵乘法用一次np.matmul批量计算，只支持algo='im2col'
+    num_workers : im2col路径的线程数（默认1，None表示CPU的核数）
+        大于1时把mini-batch分片，各片的 padding + im2col + 矩阵乘法（反向传播时为
+        矩阵乘法 + col2im）在线程池中同时执行（参见common/parallel.py）。
+        dW、db按分片的顺序求和，相同的num_workers结果完全相同，
+        与num_workers=1只有浮点数求和顺序带来的舍入误差
+    parallel_backward : 为True时im2col路径的反向传播中，dW的矩阵乘法与dcol的矩阵乘法 + col2im
+        在两个线程中同时执行（各分片内部，参见common/parallel.run_concurrently），结果与False时完全相同
+
+    1x1滤波器、步幅1、没有填充时（pointwise卷积，algo为'im2col'或'auto'）不经过im2col/col2im：
+    NCHW时对每个样本直接计算 W (FN, C) 与 x (C, H*W) 的矩阵乘法，输出就是NCHW，不需要转置；
+    NHWC时输入 (N*H*W, C) 的视图本身就是col，反向传播的dcol直接写入dx。
+
+    need_dx为False时（网络的输入层）反向传播只计算dW、db，不计算dcol和col2im，返回None。
+    """
+    def __init__(self, W, b, stride=1, pad=0, algo='im2col', layout='NCHW', groups=1, num_workers=1,
+                 parallel_backward=False):
         self.W = W
         self.b = b
         self.stride = stride
         self.pad = pad
-        
+        self.algo = algo
+        self.layout = layout
+        self.groups = groups
+        self.num_workers = num_workers
+        self.parallel_backward = parallel_backward
+
+        if layout not in ('NCHW', 'NHWC'):
+            raise ValueError("unknown layout: " + str(layout))
+        if layout == 'NHWC' and algo != 'im2col':
+            raise ValueError("NHWC layout only supports algo='im2col'")
+        if groups < 1 or W.shape[0] % groups != 0:
+            raise ValueError("filter_num must be divisible by groups")
+        if groups > 1 and algo != 'im2col':
+            raise ValueError("grouped convolution only supports algo='im2col'")
+
+        if algo == 'winograd':
+            if W.shape[2:] != (3, 3) or stride != 1:
+                raise ValueError("winograd requires 3x3 filters with stride 1")
+        elif algo not in ('im2col', 'fft', 'auto'):
+            raise ValueError("unknown conv algo: " + str(algo))
+
         # 中间数据（backward时使用）
         self.x = None   
         self.col = None
         self.col_W = None
-        
-        # 权重和偏置参数的梯度
+        self._dx_buf = None  # col2im的输出缓冲区，在多次反向传播之间重复使用
+        self.V = None  # Winograd的输入变换
+        self.X = None  # FFT卷积中输入的频域表示
+        self.algo_used = None  # 最近一次前向传播实际使用的计算方式
+
+        # 滤波器的变换（Winograd/FFT），权重更新后才重新计算
+        self._filter_cache = None
+        self._filter_cache_key = None
+        self._filter_cache_W = None
+
+        # 权重和偏置参数的梯度（im2col路径写入_dW_buf、db，形状不变时不再分配）
         self.dW = None
         self.db = None
+        self._dW_buf = None
+
+        # 前向传播的输出缓冲区（im2col路径，由common/memory_planner.py设定）
+        self.out_buf = None
+        self.need_dx = True
+
+    def _is_pointwise(self):
+        """1x1滤波器、步幅1、没有填充（im2col的结果就是输入本身）"""
+        return self.W.shape[2:] == (1, 1) and self.stride == 1 and self.pad == 0
+
+    def _transformed_filter(self, key, transform):
+        # 优化器原地更新W，所以比较W的副本来判断是否需要重新变换
+        if self._filter_cache_key != key or not np.array_equal(self._filter_cache_W, self.W):
+            self._filter_cache = transform()
+            self._filter_cache_key = key
+            self._filter_cache_W = self.W.copy()
+        return self._filter_cache
 
     def forward(self, x):
         # 前向传播，执行卷积操作
-        FN, C, FH, FW = self.W.shape
-        N, C, H, W = x.shape
+        algo = self.algo
+        if algo in ('im2col', 'auto') and self._is_pointwise():
+            algo = 'pointwise'
+        elif algo == 'auto':
+            algo = 'fft' if fft_conv.fft_is_faster(x.shape, self.W.shape, self.stride, self.pad) else 'im2col'
+        self.algo_used = algo
+
+        if algo == 'pointwise' and self.layout == 'NCHW':
+            out = self._pointwise_forward(x)
+            self.x = x
+            return out
+
+        if algo == 'winograd':
+            U = self._transformed_filter('winograd', lambda: winograd.filter_transform(self.W))
+            out, self.V = winograd.conv3x3_forward(x, U, self.b, self.pad)
+            self.x = x
+            return out
+
+        if algo == 'fft':
+            fft_shape = (x.shape[2] + 2*self.pad, x.shape[3] + 2*self.pad)
+            Wf = self._transformed_filter(fft_shape, lambda: fft_conv.filter_transform(self.W, fft_shape))
+            out, self.X = fft_conv.conv_forward(x, Wf, self.b, self.W.shape[2:], self.stride, self.pad)
+            self.x = x
+            return out
+
+        out = self._gemm_forward(x)
+        if self.layout == 'NCHW':
+            out = out.transpose(0, 3, 1, 2)
+
+        self.x = x
+
+        return out
+
+    def _gemm_forward(self, x, out=None):
+        """im2col + 矩阵乘法，返回通道在最后的 (N, out_h, out_w, FN)
+
+        col和padding后的图像从workspace借用；上一次前向传播的col在这里归还。
+        out为 (N*out_h*out_w, FN) 的缓冲区时GEMM的结果写入out。
+        """
+        FN, Cg, FH, FW = self.W.shape
+        G = self.groups
+        if self.layout == 'NHWC':
+            N, H, W, C = x.shape
+        else:
+            N, C, H, W = x.shape
+        if C != Cg * G:
+            raise ValueError("input channels do not match the filter shape and groups")
         out_h = 1 + int((H + 2*self.pad - FH) / self.stride)
         out_w = 1 + int((W + 2*self.pad - FW) / self.stride)
 
-        col = im2col(x, FH, FW, self.stride, self.pad)
-        col_W = self.W.reshape(FN, -1).T
+        ws = get_workspace()
+        ws.give_back(self.col)
+        self.col = None
 
-        out = np.dot(col, col_W) + self.b
-        out = out.reshape(N, out_h, out_w, -1).transpose(0, 3, 1, 2)
+        # 各组的滤波器 (G, Cg*FH*FW, FN/G)，按col中每组的列的顺序展开
+        if self.layout == 'NHWC':
+            # col的每一行按 (G, FH, FW, Cg) 展开，滤波器也按同样的顺序排列
+            col_W = self.W.transpose(0, 2, 3, 1).reshape(G, FN // G, -1).transpose(0, 2, 1)
+        else:
+            col_W = self.W.reshape(G, FN // G, -1).transpose(0, 2, 1)
+        if G == 1:
+            col_W = col_W[0]
+
+        P = out_h * out_w  # 每个样本的输出位置数
+        pointwise = self._is_pointwise()
+        if pointwise and self.layout == 'NHWC':
+            col = x.reshape(N * P, C)  # 1x1卷积的col就是输入本身（x为C连续时不复制）
+        else:
+            col = ws.borrow((N * P, C * FH * FW), x.dtype)
+        if out is None:
+            out = _output(self, (N * P, FN), np.result_type(col, col_W))
+        img = ws.borrow(_padded_shape(x.shape, self.pad, self.layout), x.dtype) if self.pad > 0 else None
+
+        def work(n0, n1):
+            # 分片 x[n0:n1] 对应 col、out 的第 n0*P ~ n1*P 行
+            xs = x[n0:n1]
+            cs = col[n0*P:n1*P]
+            if pointwise:
+                if self.layout == 'NCHW':  # ConvReluPool的NCHW：只需要一次转置
+                    np.copyto(cs.reshape(n1 - n0, out_h, out_w, C), xs.transpose(0, 2, 3, 1))
+            else:
+                if img is not None:
+                    xs = _pad_into(img[n0:n1], xs, self.pad, self.layout)
+                cs = im2col_strided(xs, FH, FW, self.stride, 0, self.layout, out=cs, groups=G)
+            ys = out[n0*P:n1*P]
+            M = cs.shape[0]
+            if G == 1:
+                np.dot(cs, col_W, out=ys)
+            elif FN == G:
+                # 每组只有一个滤波器（depthwise）时每组是矩阵与向量的乘法，einsum比逐组调用BLAS快
+                np.einsum('mgk,gk->mg', cs.reshape(M, G, -1), col_W[:, :, 0], out=ys)
+            else:
+                np.matmul(cs.reshape(M, G, -1).transpose(1, 0, 2), col_W,
+                          out=ys.reshape(M, G, -1).transpose(1, 0, 2))
+            ys += self.b
+
+        run_shards(work, N, self.num_workers)
+        ws.give_back(img)
 
-        self.x = x
         self.col = col
         self.col_W = col_W
 
-        return out
+        return out.reshape(N, out_h, out_w, FN)
 
     def backward(self, dout):
         # 反向传播，计算卷积层的梯度
+        if self.algo_used == 'winograd':
+            dx, self.dW, self.db = winograd.conv3x3_backward(dout, self._filter_cache, self.V,
+                                                             self.x.shape, self.pad, self.need_dx)
+            return dx
+
+        if self.algo_used == 'fft':
+            dx, self.dW, self.db = fft_conv.conv_backward(dout, self._filter_cache, self.X, self.x.shape,
+                                                          self.W.shape[2:], self.stride, self.pad,
+                                                          self.need_dx)
+            return dx
+
+        if self.algo_used == 'pointwise' and self.layout == 'NCHW':
+            return self._pointwise_backward(dout)
+
+        FN = self.W.shape[0]
+        if self.layout == 'NHWC':
+            dout = dout.reshape(-1, FN)
+        else:
+            dout = dout.transpose(0,2,3,1).reshape(-1, FN)
+
+        return self._gemm_backward(dout, self.x.shape)
+
+    def _gemm_backward(self, dout, x_shape):
+        """_gemm_forward的反向传播，dout为 (N*out_h*out_w, FN)，need_dx为False时返回None"""
+        FN, Cg, FH, FW = self.W.shape
+        G = self.groups
+        N = x_shape[0]
+        P = dout.shape[0] // N
+        col_W = self.col_W
+        need_dx = self.need_dx
+        pointwise = self._is_pointwise()
+        ws = get_workspace()
+        dcol = None
+        if need_dx:
+            dx_dtype = np.result_type(dout, col_W)
+            self._dx_buf = _padded_buffer(self._dx_buf, x_shape, self.pad, dx_dtype, self.layout)
+            if pointwise:
+                dcol = self._dx_buf.reshape(self.col.shape)  # 1x1卷积的dcol就是（通道在最后的）dx
+            else:
+                dcol = ws.borrow(self.col.shape, dx_dtype)
+        # dW按col的列的顺序 (FN, K) 保存，NHWC时K为 (FH, FW, Cg)，self.dW是转置后的视图
+        dW_shape = (FN, FH, FW, Cg) if self.layout == 'NHWC' else self.W.shape
+        self._dW_buf = _reuse(self._dW_buf, dW_shape, np.result_type(self.col, dout))
+        self.db = _reuse(self.db, (FN,), dout.dtype)
+
+        def work(n0, n1):
+            # 分片的dW、db，dcol的第 n0*P ~ n1*P 行，以及dx的第 n0 ~ n1 个样本
+            # 第一个分片的dW、db直接写入缓冲区，其余分片的结果由调用方累加
+            cs, ds = self.col[n0*P:n1*P], dout[n0*P:n1*P]
+            M = cs.shape[0]
+            if n0 == 0:
+                dW, db = self._dW_buf.reshape(FN, -1), self.db
+            else:
+                dW, db = np.empty_like(self._dW_buf).reshape(FN, -1), np.empty_like(self.db)
+
+            def param_grad():
+                # 分组时按组批量计算：col (G, M, Cg*FH*FW)、dout (G, M, FN/G)
+                if G == 1:
+                    np.dot(ds.T, cs, out=dW)
+                elif FN == G:
+                    np.einsum('mgk,mg->gk', cs.reshape(M, G, -1), ds, out=dW)
+                else:
+                    np.matmul(ds.reshape(M, G, -1).transpose(1, 2, 0), cs.reshape(M, G, -1).transpose(1, 0, 2),
+                              out=dW.reshape(G, FN // G, -1))
+                np.sum(ds, axis=0, out=db)
+
+            def input_grad():
+                dcs = dcol[n0*P:n1*P]
+                if G == 1:
+                    np.dot(ds, col_W.T, out=dcs)
+                elif FN == G:
+                    np.multiply(ds[:, :, np.newaxis], col_W[:, :, 0], out=dcs.reshape(M, G, -1))
+                else:
+                    np.matmul(ds.reshape(M, G, -1).transpose(1, 0, 2), col_W.transpose(0, 2, 1),
+                              out=dcs.reshape(M, G, -1).transpose(1, 0, 2))
+                if not pointwise:
+                    col2im_buffered(dcs, (n1 - n0,) + x_shape[1:], FH, FW, self.stride, self.pad,
+                                    out=self._dx_buf[n0:n1], layout=self.layout, groups=G)
+
+            if not need_dx:
+                param_grad()
+            elif self.parallel_backward:
+                run_concurrently(input_grad, param_grad)
+            else:
+                param_grad()
+                input_grad()
+            return dW, db
+
+        # 按分片的顺序求和，保证结果与线程的完成顺序无关
+        results = run_shards(work, N, self.num_workers)
+        dW, db = results[0]
+        for dW_s, db_s in results[1:]:
+            dW += dW_s
+            db += db_s
+        if not pointwise:
+            ws.give_back(dcol)
+
+        if self.layout == 'NHWC':
+            self.dW = self._dW_buf.transpose(0, 3, 1, 2)
+        else:
+            self.dW = self._dW_buf
+        if not need_dx:
+            return None
+
+        H, W = (x_shape[1:3] if self.layout == 'NHWC' else x_shape[2:])
+        dx = self._dx_buf[:, self.pad:H + self.pad, self.pad:W + self.pad, :]
+        if self.layout == 'NCHW':
+            dx = dx.transpose(0, 3, 1, 2)
+
+        return dx
+
+    def _pointwise_forward(self, x):
+        """NCHW的1x1卷积：各样本的 W (FN, C) · x (C, H*W)，返回 (N, FN, H, W)"""
+        FN, Cg = self.W.shape[:2]
+        G = self.groups
+        N, C, H, W = x.shape
+        if C != Cg * G:
+            raise ValueError("input channels do not match the filter shape and groups")
+
+        # 按组分开：W (G, FN/G, Cg)、x (N, G, Cg, H*W)、out (N, G, FN/G, H*W)
+        Wg = self.W.reshape(G, FN // G, Cg)
+        xg = x.reshape(N, G, Cg, H * W)
+        out = _output(self, (N, FN, H, W), np.result_type(x, self.W))
+        og = out.reshape(N, G, FN // G, H * W)
+        bg = self.b.reshape(G, FN // G, 1)
+
+        def work(n0, n1):
+            if Cg == 1 and FN == G:
+                np.multiply(xg[n0:n1], Wg, out=og[n0:n1])  # depthwise：每个通道乘以一个系数
+            else:
+                np.matmul(Wg, xg[n0:n1], out=og[n0:n1])
+            og[n0:n1] += bg
+
+        run_shards(work, N, self.num_workers)
+        return out
+
+    def _pointwise_backward(self, dout):
+        """_pointwise_forward的反向传播，need_dx为False时返回None"""
+        FN, Cg = self.W.shape[:2]
+        G = self.groups
+        N, C, H, W = self.x.shape
+        xg = self.x.reshape(N, G, Cg, H * W)
+        dg = dout.reshape(N, G, FN // G, H * W)
+        Wg = self.W.reshape(G, FN // G, Cg)
+        need_dx = self.need_dx
+        self._dW_buf = _reuse(self._dW_buf, self.W.shape, np.result_type(self.x, dout))
+        self.db = _reuse(self.db, (FN,), dout.dtype)
+        if need_dx:
+            self._dx_buf = _buffer(self._dx_buf, self.x.shape, np.result_type(dout, self.W))
+            dxg = self._dx_buf.reshape(N, G, Cg, H * W)
+
+        def work(n0, n1):
+            # 与_gemm_backward相同，第一个分片写入缓冲区，其余分片的结果由调用方累加
+            if n0 == 0:
+                dW, db = self._dW_buf, self.db
+            else:
+                dW, db = np.empty_like(self._dW_buf), np.empty_like(self.db)
+
+            def param_grad():
+                # 各样本的 dout (FN/G, H*W) · xᵀ (H*W, Cg) 的批量矩阵乘法，再对样本求和
+                np.matmul(dg[n0:n1], xg[n0:n1].transpose(0, 1, 3, 2)).sum(axis=0, out=dW.reshape(G, FN // G, Cg))
+                np.sum(dg[n0:n1], axis=(0, 3), out=db.reshape(G, FN // G))
+
+            def input_grad():
+                if Cg == 1 and FN == G:
+                    np.multiply(dg[n0:n1], Wg, out=dxg[n0:n1])
+                else:
+                    np.matmul(Wg.transpose(0, 2, 1), dg[n0:n1], out=dxg[n0:n1])
+
+            if not need_dx:
+                param_grad()
+            elif self.parallel_backward:
+                run_concurrently(input_grad, param_grad)
+            else:
+                param_grad()
+                input_grad()
+            return dW, db
+
+        results = run_shards(work, N, self.num_workers)
+        dW, db = results[0]
+        for dW_s, db_s in results[1:]:
+            dW += dW_s
+            db += db_s
+        self.dW = self._dW_buf
+        if not need_dx:
+            return None
+
+        return self._dx_buf
+
+
+class ConvReluPool(Convolution):
+    """Convolution → Relu → Pooling（pool_size x pool_size、步幅pool_size）的融合层
+
+    在im2col的GEMM结果（通道在最后）上原地执行ReLU，再直接做Max池化。
+    反向传播只需要col和池化的位置（uint8），不保留卷积的输出、ReLU的掩码和输入x。
+    池化的结果 <= 0 时ReLU的梯度为0，位置记为NO_GRAD，反向传播时不传递梯度。
+
+    Parameters
+    ----------
+    W : 滤波器 (FN, C, FH, FW)
+    b : 偏置 (FN,)
+    stride : 卷积的步幅
+    pad : 卷积的填充
+    pool_size : 池化窗口的大小（步幅与之相同）
+    layout : 输入输出的数据排列，'NCHW'（默认）或 'NHWC'
+    groups : 分组卷积的组数（参见Convolution）
+    num_workers : 卷积部分的线程数（参见Convolution）
+    parallel_backward : 卷积部分的反向传播中dW和dx同时计算（参见Convolution）
+    """
+    NO_GRAD = 255
+
+    def __init__(self, W, b, stride=1, pad=0, pool_size=2, layout='NCHW', groups=1, num_workers=1,
+                 parallel_backward=False):
+        super().__init__(W, b, stride, pad, 'im2col', layout, groups, num_workers, parallel_backward)
+        if pool_size * pool_size > self.NO_GRAD:
+            raise ValueError("pool_size is too large: " + str(pool_size))
+        self.pool_size = pool_size
+        self.algo_used = 'im2col'
+
+        self.x_shape = None
+        self.conv_shape = None
+        self.arg_max = None
+
+    def forward(self, x):
+        p = self.pool_size
         FN, C, FH, FW = self.W.shape
-        dout = dout.transpose(0,2,3,1).reshape(-1, FN)
+        H, W = x.shape[1:3] if self.layout == 'NHWC' else x.shape[2:]
+        out_h = (H + 2*self.pad - FH) // self.stride + 1
+        out_w = (W + 2*self.pad - FW) // self.stride + 1
 
-        self.db = np.sum(dout, axis=0)
-        self.dW = np.dot(self.col.T, dout)
-        self.dW = self.dW.transpose(1, 0).reshape(FN, C, FH, FW)
+        # 卷积的输出只在这里使用，从workspace借用
+        ws = get_workspace()
+        buf = ws.borrow((x.shape[0] * out_h * out_w, FN), np.result_type(x, self.W))
+        conv = self._gemm_forward(x, out=buf)
+        np.maximum(conv, 0, out=conv)
+
+        win = _pool_windows(conv, p, p, 'NHWC')
+        out, arg_max = _window_max(win, p * p, _output(self, win(0).shape, conv.dtype))
+        np.copyto(arg_max, self.NO_GRAD, where=out <= 0)
+        ws.give_back(buf)
+
+        self.x_shape = x.shape
+        self.conv_shape = conv.shape
+        self.arg_max = arg_max
+
+        if self.layout == 'NCHW':
+            out = out.transpose(0, 3, 1, 2)
+        return out
+
+    def backward(self, dout):
+        p = self.pool_size
+        if self.layout == 'NCHW':
+            dout = dout.transpose(0, 2, 3, 1)
 
-        dcol = np.dot(dout, self.col_W.T)
-        dx = col2im(dcol, self.x.shape, FH, FW, self.stride, self.pad)
+        ws = get_workspace()
+        dconv = ws.borrow(self.conv_shape, dout.dtype)
+        N, out_h, out_w, FN = self.conv_shape
+        if out_h % p or out_w % p:
+            dconv.fill(0)  # 不属于任何窗口的行/列
+        _window_scatter(_pool_windows(dconv, p, p, 'NHWC', writeable=True), dout, self.arg_max, p * p)
 
+        dx = self._gemm_backward(dconv.reshape(-1, FN), self.x_shape)
+        ws.give_back(dconv)
         return dx
 
 
 class Pooling:
-    def __init__(self, pool_h, pool_w, stride=1, pad=0):
+    """Max池化层
+
+    layout : 输入输出的数据排列，'NCHW'（默认）或 'NHWC'
+
+    stride == pool_h == pool_w 且没有填充时（例如2x2、步幅2）窗口互不重叠，
+    直接在窗口视图上求最大值，不经过im2col；arg_max只记录最大值在窗口内的位置（uint8），
+    反向传播直接写回各位置，不经过col2im。
+    """
+    def __init__(self, pool_h, pool_w, stride=1, pad=0, layout='NCHW'):
         self.pool_h = pool_h
         self.pool_w = pool_w
         self.stride = stride
         self.pad = pad
+        self.layout = layout
+        self.fast = stride == pool_h == pool_w and pad == 0 and pool_h * pool_w <= 256
         
-        self.x = None
+        self.x_shape = None
         self.arg_max = None
+        self._dx_buf = None
+        self.out_buf = None
 
     def forward(self, x):
         # 前向传播，执行池化操作
-        N, C, H, W = x.shape
+        self.x_shape = x.shape
+        if self.fast:
+            win = _pool_windows(x, self.pool_h, self.pool_w, self.layout)
+            out, self.arg_max = _window_max(win, self.pool_h * self.pool_w,
+                                            _output(self, win(0).shape, x.dtype))
+            return out
+
+        if self.layout == 'NHWC':
+            N, H, W, C = x.shape
+        else:
+            N, C, H, W = x.shape
         out_h = int(1 + (H - self.pool_h) / self.stride)
         out_w = int(1 + (W - self.pool_w) / self.stride)
 
-        col = im2col(x, self.pool_h, self.pool_w, self.stride, self.pad)
-        col = col.reshape(-1, self.pool_h*self.pool_w)
-
-        arg_max = np.argmax(col, axis=1)
-        out = np.max(col, axis=1)
-        out = out.reshape(N, out_h, out_w, C).transpose(0, 3, 1, 2)
+        ws = get_workspace()
+        buf = ws.borrow((N * out_h * out_w, C * self.pool_h * self.pool_w), x.dtype)
+        col = im2col_strided(x, self.pool_h, self.pool_w, self.stride, self.pad, self.layout, out=buf)
+        if self.layout == 'NHWC':
+            # 每一行按 (pool_h, pool_w, C) 展开，对窗口内的元素（axis=1）求最大值
+            col = col.reshape(-1, self.pool_h*self.pool_w, C)
+            arg_max = np.argmax(col, axis=1)
+            out = np.max(col, axis=1, out=_output(self, (col.shape[0], C), x.dtype))
+            out = out.reshape(N, out_h, out_w, C)
+        else:
+            col = col.reshape(-1, self.pool_h*self.pool_w)
+            arg_max = np.argmax(col, axis=1)
+            out = np.max(col, axis=1, out=_output(self, (col.shape[0],), x.dtype))
+            out = out.reshape(N, out_h, out_w, C).transpose(0, 3, 1, 2)
+        ws.give_back(buf)
 
-        self.x = x
         self.arg_max = arg_max
 
         return out
 
     def backward(self, dout):
         # 反向传播，计算池化层的梯度
-        dout = dout.transpose(0, 2, 3, 1)
-        
         pool_size = self.pool_h * self.pool_w
-        dmax = np.zeros((dout.size, pool_size))
-        dmax[np.arange(self.arg_max.size), self.arg_max.flatten()] = dout.flatten()
-        dmax = dmax.reshape(dout.shape + (pool_size,)) 
-        
-        dcol = dmax.reshape(dmax.shape[0] * dmax.shape[1] * dmax.shape[2], -1)
-        dx = col2im(dcol, self.x.shape, self.pool_h, self.pool_w, self.stride, self.pad)
+        if self.fast:
+            self._dx_buf = dx = _buffer(self._dx_buf, self.x_shape, dout.dtype)
+            H, W = self.x_shape[1:3] if self.layout == 'NHWC' else self.x_shape[2:]
+            if H % self.pool_h or W % self.pool_w:
+                dx.fill(0)  # 不属于任何窗口的行/列
+            _window_scatter(_pool_windows(dx, self.pool_h, self.pool_w, self.layout, writeable=True),
+                            dout, self.arg_max, pool_size)
+            return dx
+
+        ws = get_workspace()
+        dmax_buf = ws.borrow((dout.size, pool_size), dout.dtype)
+        dmax_buf.fill(0)
+        if self.layout == 'NHWC':
+            C = dout.shape[3]
+            dout = dout.reshape(-1, C)
+            dmax = dmax_buf.reshape(dout.shape[0], pool_size, C)
+            dmax[np.arange(dout.shape[0])[:, np.newaxis], self.arg_max, np.arange(C)] = dout
+            dcol = dmax.reshape(dout.shape[0], -1)
+        else:
+            dout = dout.transpose(0, 2, 3, 1)
+
+            dmax = dmax_buf
+            dmax[np.arange(self.arg_max.size), self.arg_max.flatten()] = dout.flatten()
+            dmax = dmax.reshape(dout.shape + (pool_size,)) 
+
+            dcol = dmax.reshape(dmax.shape[0] * dmax.shape[1] * dmax.shape[2], -1)
+        self._dx_buf = _padded_buffer(self._dx_buf, self.x_shape, self.pad, dcol.dtype, self.layout)
+        dx = col2im_buffered(dcol, self.x_shape, self.pool_h, self.pool_w, self.stride, self.pad,
+                             out=self._dx_buf, layout=self.layout)
+        ws.give_back(dmax_buf)
         
-        return dx
\ No newline at end of file
+        return dx
+
+class AvgPooling:
+    """平均池化层
+
+    layout : 输入输出的数据排列，'NCHW'（默认）或 'NHWC'
+
+    不需要记录最大值的位置，反向传播只是把 dout / (pool_h*pool_w) 分配给窗口内的各元素。
+    stride == pool_h == pool_w 且没有填充时窗口互不重叠，直接在窗口视图上求和、写回，
+    不经过im2col/col2im。有填充时补的0也计入平均（窗口大小固定为pool_h*pool_w）。
+    """
+    def __init__(self, pool_h, pool_w, stride=1, pad=0, layout='NCHW'):
+        self.pool_h = pool_h
+        self.pool_w = pool_w
+        self.stride = stride
+        self.pad = pad
+        self.layout = layout
+        self.fast = stride == pool_h == pool_w and pad == 0
+
+        self.x_shape = None
+        self._dx_buf = None
+        self.out_buf = None
+
+    def forward(self, x):
+        # 前向传播，求各窗口的平均值
+        self.x_shape = x.shape
+        pool_size = self.pool_h * self.pool_w
+        if self.fast:
+            win = _pool_windows(x, self.pool_h, self.pool_w, self.layout)
+            out = _output(self, win(0).shape, x.dtype)
+            np.copyto(out, win(0))
+            for k in range(1, pool_size):
+                out += win(k)
+            out *= 1.0 / pool_size
+            return out
+
+        if self.layout == 'NHWC':
+            N, H, W, C = x.shape
+        else:
+            N, C, H, W = x.shape
+        out_h = (H + 2*self.pad - self.pool_h) // self.stride + 1
+        out_w = (W + 2*self.pad - self.pool_w) // self.stride + 1
+
+        ws = get_workspace()
+        buf = ws.borrow((N * out_h * out_w, C * pool_size), x.dtype)
+        col = im2col_strided(x, self.pool_h, self.pool_w, self.stride, self.pad, self.layout, out=buf)
+        out = _output(self, (N * out_h * out_w, C), x.dtype)
+        if self.layout == 'NHWC':
+            # 每一行按 (pool_h, pool_w, C) 展开
+            np.mean(col.reshape(-1, pool_size, C), axis=1, out=out)
+            out = out.reshape(N, out_h, out_w, C)
+        else:
+            np.mean(col.reshape(-1, C, pool_size), axis=2, out=out)
+            out = out.reshape(N, out_h, out_w, C).transpose(0, 3, 1, 2)
+        ws.give_back(buf)
+
+        return out
+
+    def backward(self, dout):
+        # 反向传播，把梯度平均分配给窗口内的各元素
+        pool_size = self.pool_h * self.pool_w
+        dout = dout * (1.0 / pool_size)
+        if self.fast:
+            self._dx_buf = dx = _buffer(self._dx_buf, self.x_shape, dout.dtype)
+            H, W = self.x_shape[1:3] if self.layout == 'NHWC' else self.x_shape[2:]
+            if H % self.pool_h or W % self.pool_w:
+                dx.fill(0)  # 不属于任何窗口的行/列
+            win = _pool_windows(dx, self.pool_h, self.pool_w, self.layout, writeable=True)
+            for k in range(pool_size):
+                np.copyto(win(k), dout)
+            return dx
+
+        ws = get_workspace()
+        dcol_buf = ws.borrow((dout.size, pool_size), dout.dtype)
+        if self.layout == 'NHWC':
+            C = dout.shape[3]
+            dout = dout.reshape(-1, C)
+            dcol = dcol_buf.reshape(dout.shape[0], pool_size, C)
+            dcol[...] = dout[:, np.newaxis, :]
+        else:
+            C = dout.shape[1]
+            dout = dout.transpose(0, 2, 3, 1).reshape(-1, C)
+            dcol = dcol_buf.reshape(dout.shape[0], C, pool_size)
+            dcol[...] = dout[:, :, np.newaxis]
+        dcol = dcol.reshape(dout.shape[0], -1)
+        self._dx_buf = _padded_buffer(self._dx_buf, self.x_shape, self.pad, dcol.dtype, self.layout)
+        dx = col2im_buffered(dcol, self.x_shape, self.pool_h, self.pool_w, self.stride, self.pad,
+                             out=self._dx_buf, layout=self.layout)
+        ws.give_back(dcol_buf)
+
+        return dx
+
+
+class GlobalAvgPooling:
+    """全局平均池化层：(N, C, H, W)（NHWC时为 (N, H, W, C)）→ (N, C)
+
+    对每个通道的整个特征图求平均，输出可以直接作为Affine层的输入，
+    代替把特征图展开后接的大的全连接层（参数量从 C*H*W*hidden 降到 C*hidden）。
+    """
+    def __init__(self, layout='NCHW'):
+        self.layout = layout
+        self.x_shape = None
+        self._dx_buf = None
+        self.out_buf = None
+
+    def forward(self, x):
+        self.x_shape = x.shape
+        axes = (1, 2) if self.layout == 'NHWC' else (2, 3)
+        N, C = x.shape[0], x.shape[3 if self.layout == 'NHWC' else 1]
+        out = np.sum(x, axis=axes, out=_output(self, (N, C), x.dtype))
+        out *= 1.0 / (x.shape[axes[0]] * x.shape[axes[1]])
+        return out
+
+    def backward(self, dout):
+        # 各位置的梯度都是 dout / (H*W)
+        self._dx_buf = dx = _buffer(self._dx_buf, self.x_shape, dout.dtype)
+        if self.layout == 'NHWC':
+            H, W = self.x_shape[1:3]
+            np.multiply(dout[:, np.newaxis, np.newaxis, :], 1.0 / (H * W), out=dx)
+        else:
+            H, W = self.x_shape[2:]
+            np.multiply(dout[:, :, np.newaxis, np.newaxis], 1.0 / (H * W), out=dx)
+        return dx
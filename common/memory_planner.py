@@ -0,0 +1,239 @@
+# coding: utf-8
+"""激活值的静态内存规划（memory planner）
+
+网络的各层每次前向传播都新分配输出数组，Affine.x、Convolution.x 等为反向传播保留的输入
+一直保留到下一次前向传播，所有中间结果各自占用一块内存。
+但层是按顺序执行的，每个中间结果只在一段固定的时间内被使用：
+
+    时刻 i        : 第 i 层的前向传播（输出在此产生）
+    时刻 L        : 损失函数（L 为层数）
+    时刻 2L - i   : 第 i 层的反向传播
+
+plan_memory 用给定形状的输入执行一次前向传播，记录每层输出的形状、dtype，
+输出是否是输入的视图（Transpose、inplace的Relu、推理时的Dropout），以及层是否为
+反向传播保留了输入/输出，由此求出每个中间结果的生存区间；再把生存区间不重叠的
+中间结果放到同一块区域，全部排列在一个预先分配的arena中（按大小降序的first-fit）。
+
+    plan = plan_memory(network, (100, 1, 28, 28))
+    print(plan.report())
+    plan.apply()                  # 之后 network.predict / gradient 的各层输出写入arena
+    grads = network.gradient(x, t)
+    plan.remove()                 # 恢复为每次新分配
+
+apply 之后各层的输出是arena的视图，下一次前向传播会被覆盖（predict的结果需要保留时由调用方复制）。
+输入的形状与规划时不同时，各层自动回到新分配，结果不受影响。
+支持输出缓冲区（out_buf 属性）的层：Affine（AffineActivation）、Relu、Sigmoid、Dropout、BatchNormalization、
+Pooling、Convolution（im2col路径）、ConvReluPool；其他层（Winograd/FFT卷积等）的输出不放入arena。
+各层内部的缓存（im2col的col、Relu的掩码、Pooling的位置等）不在规划的范围内，
+col由workspace复用（参见common/workspace.py），掩码和位置是按位/uint8压缩保存的。
+"""
+import numpy as np
+from common.layers import Dropout, BatchNormalization
+from common.checkpoint import release
+
+ALIGNMENT = 64  # arena中各区域的起始位置按64字节对齐
+
+
+def network_layers(network):
+    """网络的层的列表（self.layers 为list或OrderedDict）"""
+    layers = network.layers
+    if isinstance(layers, dict):
+        return list(layers.values())
+    return list(layers)
+
+
+def _forward(layer, x, train_flg):
+    if isinstance(layer, (Dropout, BatchNormalization)):
+        return layer.forward(x, train_flg)
+    return layer.forward(x)
+
+
+def _retains(layer, a):
+    """层的属性中是否有与a共享内存的数组（为反向传播保留了a）"""
+    for name, v in vars(layer).items():
+        if name != 'out_buf' and isinstance(v, np.ndarray) and np.may_share_memory(v, a):
+            return True
+    return False
+
+
+def _trace(layers, x, train_flg, out_bufs=None):
+    """执行一次前向传播，记录各层的输出
+
+    out_bufs为各层的临时缓冲区的列表时，把它们设为各层的out_buf，确认输出是否写入了该缓冲区。
+    执行后BatchNormalization的移动平均、Dropout的随机数状态恢复原状，各层的缓存被丢弃。
+
+    Returns
+    -------
+    list of dict : 'shape'、'dtype'、'nbytes'、'alias'（输出是输入的视图）、
+                   'retains_input'/'retains_output'（为反向传播保留了输入/输出）、
+                   'planned'（输出写入了out_buf）
+    """
+    bn_stats = [(l, l.running_mean, l.running_var) for l in layers if isinstance(l, BatchNormalization)]
+    rng_states = [(l, l.rng.bit_generator.state) for l in layers if isinstance(l, Dropout)]
+
+    records = []
+    for i, layer in enumerate(layers):
+        buf = out_bufs[i] if out_bufs is not None else None
+        if buf is not None:
+            layer.out_buf = buf
+        y = _forward(layer, x, train_flg)
+        records.append({'shape': y.shape, 'dtype': y.dtype, 'nbytes': y.nbytes,
+                        'alias': np.may_share_memory(y, x),
+                        'retains_input': _retains(layer, x),
+                        'retains_output': _retains(layer, y),
+                        'planned': buf is not None and np.may_share_memory(y, buf)})
+        if buf is not None:
+            layer.out_buf = None
+        x = y
+
+    for l, mean, var in bn_stats:
+        l.running_mean, l.running_var = mean, var
+    for l, state in rng_states:
+        l.rng.bit_generator.state = state
+    release(layers)
+    return records
+
+
+def _analyze(layers, x, train_flg):
+    """各层的输出所占的区域及其生存区间
+
+    Returns
+    -------
+    dict : 产生该区域的层的下标 -> {'shape', 'dtype', 'nbytes', 'start', 'end', 'planned'}
+           输出是输入的视图的层不产生新的区域，网络的输入（及其视图）不在规划的范围内
+    """
+    records = _trace(layers, x, train_flg)
+    out_bufs = [np.empty(r['shape'], dtype=r['dtype']) if hasattr(layer, 'out_buf') and not r['alias']
+                else None for layer, r in zip(layers, records)]
+    probe = _trace(layers, x, train_flg, out_bufs)
+
+    L = len(layers)
+    regions = {}
+    owner = -1  # 当前的输出所在区域的产生者（-1为网络的输入）
+    for i, r in enumerate(records):
+        if not r['alias']:
+            owner = i
+            regions[i] = {'shape': r['shape'], 'dtype': r['dtype'], 'nbytes': r['nbytes'],
+                          'start': i, 'end': i, 'planned': probe[i]['planned']}
+        if owner < 0:
+            continue
+        # 第i层的输出在时刻i+1被下一层读取（最后一层的输出在时刻L被损失函数使用或返回）
+        end = i + 1
+        if train_flg:
+            if i + 1 < L and records[i + 1]['retains_input']:
+                end = max(end, 2*L - (i + 1))
+            if r['retains_output']:
+                end = max(end, 2*L - i)
+        regions[owner]['end'] = max(regions[owner]['end'], end)
+    return regions
+
+
+def _place(regions):
+    """按大小降序，把每个区域放在与之生存区间重叠的区域之间最低的空隙（first-fit），返回arena的字节数"""
+    placed = []
+    for r in sorted(regions, key=lambda r: (-r['nbytes'], r['start'])):
+        overlapping = sorted((p for p in placed if p['start'] <= r['end'] and r['start'] <= p['end']),
+                             key=lambda p: p['offset'])
+        offset = 0
+        for p in overlapping:
+            if offset + r['nbytes'] <= p['offset']:
+                break
+            end = p['offset'] + p['nbytes']
+            offset = max(offset, -(-end // ALIGNMENT) * ALIGNMENT)
+        r['offset'] = offset
+        placed.append(r)
+    return max([r['offset'] + r['nbytes'] for r in placed] + [0])
+
+
+class MemoryPlan:
+    """plan_memory的结果
+
+    Attributes
+    ----------
+    layers : 层的列表
+    regions : 各区域的dict的列表（'layer'、'shape'、'dtype'、'nbytes'、'start'、'end'、'planned'、'offset'）
+    arena_bytes : arena的字节数（规划后的峰值）
+    naive_bytes : 各层的输出各自分配时的合计字节数
+    live_peak_bytes : 同一时刻存活的区域的字节数的最大值（任何排列方式的下限）
+    unplanned_bytes : 不支持out_buf的层的输出的字节数（不放入arena）
+    train : 规划是否也适用于gradient()（参见plan_memory）
+    """
+    def __init__(self, layers, regions, train):
+        self.layers = layers
+        self.regions = regions
+        self.train = train
+        planned = [r for r in regions if r['planned']]
+        self.arena_bytes = _place(planned)
+        self.arena = np.empty(self.arena_bytes, dtype=np.uint8)
+        self.naive_bytes = sum(r['nbytes'] for r in regions)
+        self.unplanned_bytes = sum(r['nbytes'] for r in regions if not r['planned'])
+        last = max([r['end'] for r in regions] + [0])
+        self.live_peak_bytes = max([sum(r['nbytes'] for r in planned if r['start'] <= t <= r['end'])
+                                    for t in range(last + 1)] + [0])
+
+    def apply(self):
+        """把arena中的区域设为各层的out_buf"""
+        for r in self.regions:
+            if r['planned']:
+                view = self.arena[r['offset']:r['offset'] + r['nbytes']].view(r['dtype'])
+                self.layers[r['layer']].out_buf = view
+        return self
+
+    def remove(self):
+        """取消apply，各层的输出恢复为每次新分配"""
+        for layer in self.layers:
+            if hasattr(layer, 'out_buf'):
+                layer.out_buf = None
+
+    def report(self):
+        """各区域的形状、生存区间、在arena中的位置，以及规划前后的峰值"""
+        lines = ["%4s %-20s %-20s %8s %10s %10s" % ("idx", "layer", "shape", "MB", "lifetime", "offset")]
+        for r in self.regions:
+            offset = "%.2fMB" % (r['offset'] / 2**20) if r['planned'] else "-"
+            lines.append("%4d %-20s %-20s %8.2f %10s %10s" % (
+                r['layer'], type(self.layers[r['layer']]).__name__, str(r['shape']), r['nbytes'] / 2**20,
+                "%d-%d" % (r['start'], r['end']), offset))
+        lines.append("naive (independent allocations): %8.2f MB" % (self.naive_bytes / 2**20))
+        lines.append("planned arena:                   %8.2f MB" % (self.arena_bytes / 2**20))
+        lines.append("lower bound (live peak):         %8.2f MB" % (self.live_peak_bytes / 2**20))
+        if self.unplanned_bytes:
+            lines.append("not planned (no out_buf):        %8.2f MB" % (self.unplanned_bytes / 2**20))
+        return "\n".join(lines)
+
+
+def plan_memory(network, input_shape, train=True):
+    """为network的各层的输出规划arena
+
+    Parameters
+    ----------
+    network : 网络（self.layers 为层的list或OrderedDict，不能使用checkpoint_segments）
+    input_shape : 输入数据的形状（e.g. (100, 1, 28, 28)）
+    train : 为True时规划同时适用于 gradient() 和 predict()（考虑为反向传播保留的数据，
+        以及推理时Dropout直接返回输入的情况）；False时只适用于推理（train_flg=False的predict）
+
+    Returns
+    -------
+    MemoryPlan（尚未apply）
+    """
+    if getattr(network, 'checkpoint_segments', None) is not None:
+        raise ValueError("memory plan does not support checkpoint_segments")
+    layers = network_layers(network)
+    for layer in layers:
+        if hasattr(layer, 'out_buf'):
+            layer.out_buf = None
+    x = np.random.default_rng(0).random(input_shape).astype(getattr(network, 'dtype', np.float64))
+
+    regions = _analyze(layers, x, False)
+    if train:
+        # 合并学习时和推理时的生存区间，两种情况下都不会有生存区间重叠的区域共用内存
+        for i, r in _analyze(layers, x, True).items():
+            if i in regions:
+                e = regions[i]
+                e['end'] = max(e['end'], r['end'])
+                e['planned'] = e['planned'] and r['planned']
+            else:
+                regions[i] = r
+
+    for i, r in regions.items():
+        r['layer'] = i
+    return MemoryPlan(layers, [regions[i] for i in sorted(regions)], train)
@@ -5,6 +5,7 @@ import numpy as np
 from collections import OrderedDict
 from common.layers import *
 from common.gradient import numerical_gradient
+from common.config import get_default_dtype
 
 
 class MultiLayerNet:
@@ -12,6 +13,7 @@ class MultiLayerNet:
 
     网络结构（hidden_layer_num = len(hidden_size_list)）：
         Affine1 -> Activation1 -> Affine2 -> Activation2 -> ... -> Affine(last) -> SoftmaxWithLoss
+    fuse_activation=True 时隐藏层的 Affine -> Activation 合并为一个 AffineActivation 层（名称为 Affine1、Affine2、...）
 
     注意：
     - self.layers 不包含最后的 SoftmaxWithLoss（它单独放在 self.last_layer）
@@ -27,25 +29,36 @@ class MultiLayerNet:
         指定'relu'或'he'的情况下设定“He的初始值”
         指定'sigmoid'或'xavier'的情况下设定“Xavier的初始值”
     weight_decay_lambda : Weight Decay（L2范数）的强度
+    fuse_activation : 隐藏层是否使用 AffineActivation（在矩阵乘法的输出上原地计算激活函数，
+        反向传播只缓存激活后的输出；结果与不融合时相同）
+
+    参数和输入使用生成时的 common.config.get_default_dtype()（self.dtype）
     """
     def __init__(self, input_size, hidden_size_list, output_size,
-                activation='relu', weight_init_std='relu', weight_decay_lambda=0):
+                activation='relu', weight_init_std='relu', weight_decay_lambda=0, fuse_activation=False):
         self.input_size = input_size
         self.output_size = output_size
         self.hidden_size_list = hidden_size_list
         self.hidden_layer_num = len(hidden_size_list)
         self.weight_decay_lambda = weight_decay_lambda # L2 正则系数
+        self.fuse_activation = fuse_activation
+        self.dtype = get_default_dtype()
         self.params = {}
 
         # 初始化权重
         self.__init_weight(weight_init_std)
 
         # 生成层
-        activation_layer = {'sigmoid': Sigmoid, 'relu': Relu}
+        # Affine、BatchNormalization的输出不再被使用，ReLU可以原地计算
+        activation_layer = {'sigmoid': Sigmoid, 'relu': lambda: Relu(inplace=True)}
         self.layers = OrderedDict()
         # 依次添加：Affine -> Activation（隐藏层）
         for idx in range(1, self.hidden_layer_num+1):
             # Affine 层保存 W、b 的引用，用于 forward/backward
+            if fuse_activation:
+                self.layers['Affine' + str(idx)] = AffineActivation(self.params['W' + str(idx)],
+                                                                  self.params['b' + str(idx)], activation)
+                continue
             self.layers['Affine' + str(idx)] = Affine(self.params['W' + str(idx)],
                                                     self.params['b' + str(idx)])
             self.layers['Activation_function' + str(idx)] = activation_layer[activation]()
@@ -57,6 +70,10 @@ class MultiLayerNet:
 
         self.last_layer = SoftmaxWithLoss() # # 最后的损失层：softmax + cross entropy
 
+        # 反向传播到第一个Affine层为止，它的输入梯度不再计算（参见freeze_prefix）
+        self.frozen = 0
+        self.backward_start = backward_start(list(self.layers.values()))
+
     def __init_weight(self, weight_init_std):
         """设定权重的初始值
 
@@ -88,12 +105,22 @@ class MultiLayerNet:
                 scale = np.sqrt(1.0 / all_size_list[idx - 1])  # 使用sigmoid的情况下推荐的初始值
 
             # W: 高斯随机初始化 * scale
-            self.params['W' + str(idx)] = scale * np.random.randn(all_size_list[idx-1], all_size_list[idx])
+            self.params['W' + str(idx)] = (scale * np.random.randn(all_size_list[idx-1], all_size_list[idx])).astype(self.dtype)
             # b: 初始化为 0
-            self.params['b' + str(idx)] = np.zeros(all_size_list[idx])
+            self.params['b' + str(idx)] = np.zeros(all_size_list[idx], dtype=self.dtype)
+
+    def freeze_prefix(self, n):
+        """冻结前n个有参数的层（Affine1、Affine2、...）
+
+        gradient()不再计算被冻结的层的梯度，返回的dict中也不包含它们的参数（优化器只更新dict中的参数）。
+        反向传播到第一个没有被冻结的有参数的层为止，该层的输入梯度（dx）也不计算。n=0时解除冻结。
+        """
+        self.frozen = n
+        self.backward_start = backward_start(list(self.layers.values()), n)
 
     def predict(self, x):
         """仅做前向传播，输出网络最后一层 Affine 的结果（scores/logits）"""
+        x = x.astype(self.dtype, copy=False)
         for layer in self.layers.values():
             x = layer.forward(x)
 
@@ -178,17 +205,25 @@ class MultiLayerNet:
         dout = 1 # 对 loss 的导数起点：dL/dL = 1
         dout = self.last_layer.backward(dout) # 先从 SoftmaxWithLoss 反传到最后一层 Affine 的输出
 
-        layers = list(self.layers.values())
+        # 被冻结的层及其之前的层不需要反向传播
+        layers = list(self.layers.values())[self.backward_start:]
         layers.reverse()
         for layer in layers:
             dout = layer.backward(dout)
 
         # 设定
         grads = {}
+        trainable = list(self.layers.keys())[self.backward_start:]  # 没有被冻结的层
         for idx in range(1, self.hidden_layer_num+2):
+            if 'Affine' + str(idx) not in trainable:
+                continue
             # dW = Affine 层反传得到的 dW + L2 正则项的梯度（lambda * W）
-            grads['W' + str(idx)] = self.layers['Affine' + str(idx)].dW + self.weight_decay_lambda * self.layers['Affine' + str(idx)].W
+            # 直接加在 Affine 层持有的 dW 缓冲区上（返回的梯度是各层缓冲区本身，不复制）
+            layer = self.layers['Affine' + str(idx)]
+            if self.weight_decay_lambda != 0:
+                layer.dW += self.weight_decay_lambda * layer.W
+            grads['W' + str(idx)] = layer.dW
             # db = Affine 层反传得到的 db
-            grads['b' + str(idx)] = self.layers['Affine' + str(idx)].db
+            grads['b' + str(idx)] = layer.db
 
         return grads
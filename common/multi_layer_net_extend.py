@@ -5,6 +5,8 @@ import numpy as np
 from collections import OrderedDict
 from common.layers import *
 from common.gradient import numerical_gradient
+from common.multi_layer_net import MultiLayerNet
+from common.config import get_default_dtype, set_default_dtype
 
 class MultiLayerNetExtend:
     """扩展版的全连接的多层神经网络
@@ -24,34 +26,47 @@ class MultiLayerNetExtend:
     use_dropout: 是否使用Dropout
     dropout_ration : Dropout的比例
     use_batchNorm: 是否使用Batch Normalization
+    fuse_activation : Affine之后直接是激活函数的隐藏层（不使用Batch Normalization时）是否合并为
+        AffineActivation（名称为 Affine1、Affine2、...）；fold_batchnorm生成的网络也使用这个设定
+
+    参数和输入使用生成时的 common.config.get_default_dtype()（self.dtype）
     """
     def __init__(self, input_size, hidden_size_list, output_size,
                  activation='relu', weight_init_std='relu', weight_decay_lambda=0, 
-                 use_dropout = False, dropout_ration = 0.5, use_batchnorm=False):
+                 use_dropout = False, dropout_ration = 0.5, use_batchnorm=False, fuse_activation=False):
         self.input_size = input_size
         self.output_size = output_size
         self.hidden_size_list = hidden_size_list
         self.hidden_layer_num = len(hidden_size_list)
+        self.activation = activation
         self.use_dropout = use_dropout
         self.weight_decay_lambda = weight_decay_lambda
         self.use_batchnorm = use_batchnorm
+        self.fuse_activation = fuse_activation
+        self.dtype = get_default_dtype()
         self.params = {}
 
         # 初始化权重
         self.__init_weight(weight_init_std)
 
         # 生成层
-        activation_layer = {'sigmoid': Sigmoid, 'relu': Relu}
+        # Affine、BatchNormalization的输出不再被使用，ReLU可以原地计算
+        activation_layer = {'sigmoid': Sigmoid, 'relu': lambda: Relu(inplace=True)}
         self.layers = OrderedDict()
         for idx in range(1, self.hidden_layer_num+1):
-            self.layers['Affine' + str(idx)] = Affine(self.params['W' + str(idx)],
-                                                      self.params['b' + str(idx)])
-            if self.use_batchnorm:
-                self.params['gamma' + str(idx)] = np.ones(hidden_size_list[idx-1])
-                self.params['beta' + str(idx)] = np.zeros(hidden_size_list[idx-1])
-                self.layers['BatchNorm' + str(idx)] = BatchNormalization(self.params['gamma' + str(idx)], self.params['beta' + str(idx)])
-                
-            self.layers['Activation_function' + str(idx)] = activation_layer[activation]()
+            if fuse_activation and not self.use_batchnorm:
+                # BatchNormalization在Affine和激活函数之间时不能合并
+                self.layers['Affine' + str(idx)] = AffineActivation(self.params['W' + str(idx)],
+                                                                  self.params['b' + str(idx)], activation)
+            else:
+                self.layers['Affine' + str(idx)] = Affine(self.params['W' + str(idx)],
+                                                          self.params['b' + str(idx)])
+                if self.use_batchnorm:
+                    self.params['gamma' + str(idx)] = np.ones(hidden_size_list[idx-1], dtype=self.dtype)
+                    self.params['beta' + str(idx)] = np.zeros(hidden_size_list[idx-1], dtype=self.dtype)
+                    self.layers['BatchNorm' + str(idx)] = BatchNormalization(self.params['gamma' + str(idx)], self.params['beta' + str(idx)])
+
+                self.layers['Activation_function' + str(idx)] = activation_layer[activation]()
             
             if self.use_dropout:
                 self.layers['Dropout' + str(idx)] = Dropout(dropout_ration)
@@ -61,6 +76,10 @@ class MultiLayerNetExtend:
 
         self.last_layer = SoftmaxWithLoss()
 
+        # 反向传播到第一个Affine层为止，它的输入梯度不再计算（参见freeze_prefix）
+        self.frozen = 0
+        self.backward_start = backward_start(list(self.layers.values()))
+
     def __init_weight(self, weight_init_std):
         """设定权重的初始值
 
@@ -77,10 +96,21 @@ class MultiLayerNetExtend:
                 scale = np.sqrt(2.0 / all_size_list[idx - 1])  # 使用ReLU的情况下推荐的初始值
             elif str(weight_init_std).lower() in ('sigmoid', 'xavier'):
                 scale = np.sqrt(1.0 / all_size_list[idx - 1])  # 使用sigmoid的情况下推荐的初始值
-            self.params['W' + str(idx)] = scale * np.random.randn(all_size_list[idx-1], all_size_list[idx])
-            self.params['b' + str(idx)] = np.zeros(all_size_list[idx])
+            self.params['W' + str(idx)] = (scale * np.random.randn(all_size_list[idx-1], all_size_list[idx])).astype(self.dtype)
+            self.params['b' + str(idx)] = np.zeros(all_size_list[idx], dtype=self.dtype)
+
+    def freeze_prefix(self, n):
+        """冻结前n个有参数的层（按 Affine1、BatchNorm1、Affine2、... 的顺序计数）
+
+        gradient()不再计算被冻结的层的梯度，返回的dict中也不包含它们的参数（优化器只更新dict中的参数）。
+        反向传播到第一个没有被冻结的有参数的层为止，该层的输入梯度（dx）也不计算。n=0时解除冻结。
+        被冻结的BatchNormalization层学习时也使用移动平均归一化，不再更新running_mean、running_var。
+        """
+        self.frozen = n
+        self.backward_start = backward_start(list(self.layers.values()), n)
 
     def predict(self, x, train_flg=False):
+        x = x.astype(self.dtype, copy=False)
         for key, layer in self.layers.items():
             if "Dropout" in key or "BatchNorm" in key:
                 x = layer.forward(x, train_flg)
@@ -145,19 +175,66 @@ class MultiLayerNetExtend:
         dout = 1
         dout = self.last_layer.backward(dout)
 
-        layers = list(self.layers.values())
+        # 被冻结的层及其之前的层不需要反向传播
+        layers = list(self.layers.values())[self.backward_start:]
         layers.reverse()
         for layer in layers:
             dout = layer.backward(dout)
 
         # 设定
         grads = {}
+        trainable = list(self.layers.keys())[self.backward_start:]  # 没有被冻结的层
         for idx in range(1, self.hidden_layer_num+2):
-            grads['W' + str(idx)] = self.layers['Affine' + str(idx)].dW + self.weight_decay_lambda * self.params['W' + str(idx)]
-            grads['b' + str(idx)] = self.layers['Affine' + str(idx)].db
-
-            if self.use_batchnorm and idx != self.hidden_layer_num+1:
+            if 'Affine' + str(idx) in trainable:
+                layer = self.layers['Affine' + str(idx)]
+                if self.weight_decay_lambda != 0:
+                    layer.dW += self.weight_decay_lambda * self.params['W' + str(idx)]  # 原地加在Affine层的dW上
+                grads['W' + str(idx)] = layer.dW
+                grads['b' + str(idx)] = layer.db
+
+            if 'BatchNorm' + str(idx) in trainable:
                 grads['gamma' + str(idx)] = self.layers['BatchNorm' + str(idx)].dgamma
                 grads['beta' + str(idx)] = self.layers['BatchNorm' + str(idx)].dbeta
 
-        return grads
\ No newline at end of file
+        return grads
+
+    def fold_batchnorm(self):
+        """生成推理用的网络：把Batch Normalization合并到前面的Affine层
+
+        推理时BN是逐元素的一次函数
+            y = (z - running_mean) * gamma / sqrt(running_var + eps) + beta
+        所以 z = x W + b 之后的BN可以合并为
+            W' = W * scale,  b' = (b - running_mean) * scale + beta,  scale = gamma / sqrt(running_var + eps)
+        Dropout在推理时什么也不做，直接去掉。
+
+        Returns
+        -------
+        MultiLayerNet : 没有BN层和Dropout层的网络，predict()的结果与本网络 predict(x, train_flg=False)
+            在浮点数误差范围内相同（只用于推理，weight_decay_lambda为0）
+        """
+        # MultiLayerNet用np.random初始化的权重随后会被覆盖，恢复随机数的状态，不影响调用方之后的学习
+        rng_state = np.random.get_state()
+        old_dtype = set_default_dtype(self.dtype)  # 与本网络使用相同的dtype
+        try:
+            network = MultiLayerNet(self.input_size, self.hidden_size_list, self.output_size,
+                                    activation=self.activation, fuse_activation=self.fuse_activation)
+        finally:
+            set_default_dtype(old_dtype)
+            np.random.set_state(rng_state)
+        for idx in range(1, self.hidden_layer_num + 2):
+            W = self.params['W' + str(idx)]
+            b = self.params['b' + str(idx)]
+            bn = self.layers.get('BatchNorm' + str(idx))
+            if bn is not None:
+                D = W.shape[1]
+                running_mean = bn.running_mean if bn.running_mean is not None else np.zeros(D)
+                running_var = bn.running_var if bn.running_var is not None else np.zeros(D)
+                scale = bn.gamma / np.sqrt(running_var + bn.eps)
+                W = W * scale
+                b = (b - running_mean) * scale + bn.beta
+
+            # 原地写入，Affine层仍然引用network.params中的数组
+            network.params['W' + str(idx)][...] = W
+            network.params['b' + str(idx)][...] = b
+
+        return network
\ No newline at end of file
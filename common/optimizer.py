@@ -16,7 +16,7 @@ class SGD:
         :param params: 模型参数 (字典)
         :param grads: 参数的梯度 (字典)
         """
-        for key in params.keys():
+        for key in grads.keys():  # 只更新有梯度的参数（被冻结的层的参数不在grads中）
             params[key] -= self.lr * grads[key]  # 参数更新
 
 
@@ -45,7 +45,7 @@ class Momentum:
         if self.v is None:
             self.v = {key: np.zeros_like(val) for key, val in params.items()}  # 初始化速度
         
-        for key in params.keys():
+        for key in grads.keys():
             self.v[key] = self.momentum * self.v[key] - self.lr * grads[key]  # 更新速度
             params[key] += self.v[key]  # 更新参数
 
@@ -74,7 +74,7 @@ class Nesterov:
         if self.v is None:
             self.v = {key: np.zeros_like(val) for key, val in params.items()}  # 初始化速度
         
-        for key in params.keys():
+        for key in grads.keys():
             self.v[key] *= self.momentum
             self.v[key] -= self.lr * grads[key]
             params[key] += self.momentum * self.momentum * self.v[key]
@@ -103,7 +103,7 @@ class AdaGrad:
         if self.h is None:
             self.h = {key: np.zeros_like(val) for key, val in params.items()}  # 初始化累积梯度平方和
         
-        for key in params.keys():
+        for key in grads.keys():
             self.h[key] += grads[key] * grads[key]  # 累积梯度平方
             params[key] -= self.lr * grads[key] / (np.sqrt(self.h[key]) + 1e-7)  # 更新参数
 
@@ -132,7 +132,7 @@ class RMSprop:
         if self.h is None:
             self.h = {key: np.zeros_like(val) for key, val in params.items()}  # 初始化累积梯度平方和
         
-        for key in params.keys():
+        for key in grads.keys():
             self.h[key] *= self.decay_rate
             self.h[key] += (1 - self.decay_rate) * grads[key] * grads[key]  # 平滑梯度平方
             params[key] -= self.lr * grads[key] / (np.sqrt(self.h[key]) + 1e-7)  # 更新参数
@@ -170,9 +170,10 @@ class Adam:
                 self.v[key] = np.zeros_like(val)
         
         self.iter += 1
-        lr_t = self.lr * np.sqrt(1.0 - self.beta2**self.iter) / (1.0 - self.beta1**self.iter)  # 偏差校正
+        # 偏差校正（转换为Python的float，np.float64的标量会把float32的参数提升为float64）
+        lr_t = float(self.lr * np.sqrt(1.0 - self.beta2**self.iter) / (1.0 - self.beta1**self.iter))
         
-        for key in params.keys():
+        for key in grads.keys():
             self.m[key] += (1 - self.beta1) * (grads[key] - self.m[key])  # 更新一阶动量
             self.v[key] += (1 - self.beta2) * (grads[key]**2 - self.v[key])  # 更新二阶动量
             
@@ -0,0 +1,92 @@
+# coding: utf-8
+"""按mini-batch分片的多线程执行
+
+im2col 的复制、np.dot、col2im 的累加在 NumPy 内部都会释放 GIL，
+把 mini-batch 分成若干片、用线程池同时处理，就能用上多个核。
+各片的结果按分片的顺序返回，调用方按固定的顺序合并（例如 dW 的求和），
+所以同样的 num_workers 每次的结果完全相同。
+
+run_concurrently 同时执行一层内部互不依赖的几个计算（例如反向传播中 dx 和 dW 的矩阵乘法），
+mini-batch较小时单个GEMM用不满所有核，两个GEMM同时执行可以填补空闲的核。
+
+注意：BLAS（OpenBLAS/MKL）本身也可能是多线程的，与这里的线程数相乘后
+可能超过核数，必要时用 OPENBLAS_NUM_THREADS 等环境变量限制 BLAS 的线程数。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executor = None
+_executor_workers = 0
+_concurrent_executor = None
+_concurrent_lock = threading.Lock()
+
+
+def get_executor(num_workers):
+    """各层共用的线程池，线程数不足时重新创建"""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers < num_workers:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='shard')
+        _executor_workers = num_workers
+    return _executor
+
+
+def shard_ranges(n, num_shards):
+    """把 range(n) 分成 num_shards 个连续的区间（大小最多相差1），返回 [(start, end), ...]"""
+    num_shards = max(1, min(num_shards, n))
+    bounds = [n * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def run_shards(func, n, num_workers=1):
+    """对 range(n) 的各分片并行执行 func(start, end)
+
+    Parameters
+    ----------
+    func : 处理一个分片的函数，参数为分片的起止下标
+    n : 元素数（mini-batch的大小）
+    num_workers : 线程数（分片数），None表示CPU的核数，1时直接在调用方的线程中执行
+
+    Returns
+    -------
+    按分片顺序排列的 func 的返回值的列表
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    ranges = shard_ranges(n, num_workers)
+    if len(ranges) == 1:
+        return [func(*ranges[0])]
+
+    executor = get_executor(len(ranges))
+    futures = [executor.submit(func, start, end) for start, end in ranges]
+    return [f.result() for f in futures]
+
+
+def _get_concurrent_executor():
+    """run_concurrently的线程池（第一次使用时创建）
+
+    run_concurrently会在run_shards的多个分片线程中同时被调用，创建时加锁，只创建一个线程池。
+    """
+    global _concurrent_executor
+    if _concurrent_executor is None:
+        with _concurrent_lock:
+            if _concurrent_executor is None:
+                _concurrent_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                          thread_name_prefix='concurrent')
+    return _concurrent_executor
+
+
+def run_concurrently(*funcs):
+    """同时执行互不依赖的几个无参数的函数，按顺序返回它们的返回值的列表
+
+    第一个函数在调用方的线程中执行，其余的交给另一个线程池（与run_shards的线程池分开，
+    所以在run_shards的分片中调用也不会因为等待同一个线程池的线程而死锁）。
+    """
+    if len(funcs) == 1:
+        return [funcs[0]()]
+    executor = _get_concurrent_executor()
+    futures = [executor.submit(f) for f in funcs[1:]]
+    first = funcs[0]()
+    return [first] + [f.result() for f in futures]
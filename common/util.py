@@ -89,7 +89,7 @@ def im2col(input_data, filter_h, filter_w, stride=1, pad=0):
     # col[n, c, y, x, oh, ow] 表示：
     # 第 n 个样本、第 c 个通道，
     # 窗口内部偏移 (y, x)，输出位置 (oh, ow) 对应的那个输入像素
-    col = np.zeros((N, C, filter_h, filter_w, out_h, out_w))
+    col = np.zeros((N, C, filter_h, filter_w, out_h, out_w), dtype=input_data.dtype)
 
     # 遍历窗口内部坐标 (y, x)，用切片一次性取出所有输出位置 (oh, ow) 的值
     for y in range(filter_h):
@@ -113,6 +113,56 @@ def im2col(input_data, filter_h, filter_w, stride=1, pad=0):
     return col
 
 
+def im2col_strided(input_data, filter_h, filter_w, stride=1, pad=0, layout='NCHW', out=None, groups=1):
+    """
+    im2col 的快速版本：用滑窗视图（as_strided）代替 6D 缓冲区和双重循环。
+
+    对 padding 后的图像构造形状为 (N, out_h, out_w, C, FH, FW) 的只读视图，
+    视图本身不复制数据，最后的 reshape 是唯一一次复制。
+    输出与 im2col 相同，保持输入的 dtype。
+
+    layout='NHWC' 时输入的形状为 (N, H, W, C)，每一行按 (FH, FW, C) 的顺序展开，
+    即 col 的形状为 (N*out_h*out_w, FH*FW*C)。
+    groups > 1 时（分组卷积）按 (groups, FH, FW, C/groups) 的顺序展开，使每组的列连续；
+    NCHW 的 (C, FH, FW) 顺序本来就是按组连续的，不受 groups 影响。
+
+    out 为 (N*out_h*out_w, C*FH*FW) 的C连续数组时结果写入 out（例如从 workspace 借用的缓冲区）。
+
+    其余参数与返回值同 im2col。
+    """
+    if layout == 'NHWC':
+        N, H, W, C = input_data.shape
+    else:
+        N, C, H, W = input_data.shape
+    out_h = (H + 2 * pad - filter_h) // stride + 1
+    out_w = (W + 2 * pad - filter_w) // stride + 1
+
+    img = input_data
+    if pad > 0:
+        pad_width = [(0, 0), (pad, pad), (pad, pad), (0, 0)] if layout == 'NHWC' else \
+                    [(0, 0), (0, 0), (pad, pad), (pad, pad)]
+        img = np.pad(input_data, pad_width, mode='constant')
+
+    if layout == 'NHWC':
+        # 滑窗视图：view[n, oh, ow, g, y, x, c] = img[n, oh*S + y, ow*S + x, g*Cg + c]
+        sN, sH, sW, sC = img.strides
+        Cg = C // groups
+        shape = (N, out_h, out_w, groups, filter_h, filter_w, Cg)
+        strides = (sN, sH * stride, sW * stride, sC * Cg, sH, sW, sC)
+    else:
+        # 滑窗视图：view[n, oh, ow, c, y, x] = img[n, c, oh*S + y, ow*S + x]
+        sN, sC, sH, sW = img.strides
+        shape = (N, out_h, out_w, C, filter_h, filter_w)
+        strides = (sN, sH * stride, sW * stride, sC, sH, sW)
+    view = np.lib.stride_tricks.as_strided(img, shape=shape, strides=strides, writeable=False)
+
+    # 视图不连续，reshape 时复制一次，得到 (N*out_h*out_w, C*FH*FW)
+    if out is None:
+        return view.reshape(N * out_h * out_w, -1)
+    np.copyto(out.reshape(shape), view)
+    return out
+
+
 def col2im(col, input_shape, filter_h, filter_w, stride=1, pad=0):
     """
 
@@ -134,11 +184,75 @@ def col2im(col, input_shape, filter_h, filter_w, stride=1, pad=0):
     out_w = (W + 2*pad - filter_w)//stride + 1
     col = col.reshape(N, out_h, out_w, C, filter_h, filter_w).transpose(0, 3, 4, 5, 1, 2)
 
-    img = np.zeros((N, C, H + 2*pad + stride - 1, W + 2*pad + stride - 1))
+    img = np.zeros((N, C, H + 2*pad + stride - 1, W + 2*pad + stride - 1), dtype=col.dtype)
     for y in range(filter_h):
         y_max = y + stride*out_h
         for x in range(filter_w):
             x_max = x + stride*out_w
             img[:, :, y:y_max:stride, x:x_max:stride] += col[:, :, y, x, :, :]
 
-    return img[:, :, pad:H + pad, pad:W + pad]
\ No newline at end of file
+    return img[:, :, pad:H + pad, pad:W + pad]
+
+def col2im_buffered(col, input_shape, filter_h, filter_w, stride=1, pad=0, out=None, layout='NCHW',
+                    groups=1):
+    """
+    col2im 的快速版本，用于 Convolution/Pooling 的反向传播。
+
+    - 不对 col 做 transpose 复制：col 只 reshape 成 (N, out_h, out_w, C, FH, FW) 视图，
+      累加到通道在最后的图像 (N, H+2*pad, W+2*pad, C) 上，每次累加写入的都是连续的 C 个元素
+    - 结果写入 out（形状 (N, H+2*pad, W+2*pad, C)），调用方可以在多次调用之间
+      重复使用同一个缓冲区；out 为 None 时新分配
+    - stride >= filter_h 且 stride >= filter_w 时窗口互不重叠，每个像素最多来自一个窗口，
+      不需要累加，一次赋值即可
+
+    返回值是 out 去掉 padding 并转置为 (N, C, H, W) 的视图（不复制），
+    下一次使用同一个 out 调用时会被覆盖。
+
+    layout='NHWC' 时 input_shape 为 (N, H, W, C)，col 按 im2col_strided 的 NHWC 顺序展开，
+    返回值是形状为 (N, H, W, C) 的视图。groups 的含义同 im2col_strided。
+    """
+    if layout == 'NHWC':
+        N, H, W, C = input_shape
+    else:
+        N, C, H, W = input_shape
+    out_h = (H + 2*pad - filter_h)//stride + 1
+    out_w = (W + 2*pad - filter_w)//stride + 1
+    if layout == 'NHWC':
+        col = col.reshape(N, out_h, out_w, groups, filter_h, filter_w, C // groups)
+        window = col.transpose(0, 1, 4, 2, 5, 3, 6)
+        tap = lambda y, x: col[:, :, :, :, y, x, :]
+    else:
+        col = col.reshape(N, out_h, out_w, C, filter_h, filter_w)
+        window = col.transpose(0, 1, 4, 2, 5, 3)
+        tap = lambda y, x: col[:, :, :, :, y, x]
+
+    if out is None:
+        out = np.empty((N, H + 2*pad, W + 2*pad, C), dtype=col.dtype)
+    img = out
+    if layout == 'NHWC':
+        img = img.reshape(N, H + 2*pad, W + 2*pad, groups, C // groups)
+
+    if stride >= filter_h and stride >= filter_w:
+        # 窗口恰好铺满整张图像时，不需要先清零
+        if not (stride == filter_h == filter_w and out_h*stride == H + 2*pad and out_w*stride == W + 2*pad):
+            img.fill(0)
+        # view[n, oh, y, ow, x, ...] = img[n, oh*S + y, ow*S + x, ...]
+        sN, sH, sW = img.strides[:3]
+        view = np.lib.stride_tricks.as_strided(
+            img,
+            shape=(N, out_h, filter_h, out_w, filter_w) + img.shape[3:],
+            strides=(sN, sH * stride, sH, sW * stride, sW) + img.strides[3:]
+        )
+        view[...] = window
+    else:
+        img.fill(0)
+        for y in range(filter_h):
+            y_max = y + stride*out_h
+            for x in range(filter_w):
+                x_max = x + stride*out_w
+                img[:, y:y_max:stride, x:x_max:stride, :] += tap(y, x)
+
+    img = out[:, pad:H + pad, pad:W + pad, :]
+    if layout == 'NHWC':
+        return img
+    return img.transpose(0, 3, 1, 2)
@@ -0,0 +1,195 @@
+# coding: utf-8
+"""Winograd F(2x2, 3x3) 卷积（3x3 滤波器、步幅 1）
+
+参考：Lavin & Gray, "Fast Algorithms for Convolutional Neural Networks"
+http://arxiv.org/abs/1509.09308
+
+把输出切成 2x2 的块，每块只依赖 4x4 的输入块：
+    Y = A^T [ (G g G^T) ⊙ (B^T d B) ] A
+在变换域里，对通道的求和变成 16 个独立的矩阵乘法，
+乘法次数是直接卷积（im2col）的 1/2.25，也不需要 9 倍大小的 col 矩阵。
+
+数值误差：变换矩阵只含 0、±1、±0.5，舍入误差很小。
+与 im2col 路径相比，float64 下最大绝对误差约为 1e-12 量级，
+float32 下约为 1e-5 量级（相对于输出的数值范围）。
+"""
+import numpy as np
+
+# 滤波器变换 G (4x3)
+G = np.array([[1.0, 0.0, 0.0],
+              [0.5, 0.5, 0.5],
+              [0.5, -0.5, 0.5],
+              [0.0, 0.0, 1.0]])
+
+
+def filter_transform(W):
+    """滤波器变换 U = G g G^T
+
+    Parameters
+    ----------
+    W : 滤波器 (FN, C, 3, 3)
+
+    Returns
+    -------
+    U : (16, FN, C)，U[a*4+b] 是变换域中 (a, b) 位置的 FN x C 矩阵
+    """
+    FN, C = W.shape[:2]
+    g = G.astype(W.dtype)
+    U = np.einsum('ak,fckl,bl->abfc', g, W, g)
+    return np.ascontiguousarray(U).reshape(16, FN, C)
+
+
+def _tile_view(img, th, tw):
+    """img (N, C, 2*th+2, 2*tw+2) 上的 4x4 块视图，形状 (4, 4, C, N, th, tw)
+
+    view[k, l, c, n, i, j] = img[n, c, 2*i + k, 2*j + l]
+    """
+    N, C = img.shape[:2]
+    sN, sC, sH, sW = img.strides
+    return np.lib.stride_tricks.as_strided(
+        img, shape=(4, 4, C, N, th, tw),
+        strides=(sH, sW, sC, sN, 2 * sH, 2 * sW), writeable=False)
+
+
+def _input_transform(d):
+    """V = B^T d B，d 的形状为 (4, 4, ...)，沿前两个轴变换"""
+    t = np.empty(d.shape, dtype=d.dtype)
+    np.subtract(d[0], d[2], out=t[0])
+    np.add(d[1], d[2], out=t[1])
+    np.subtract(d[2], d[1], out=t[2])
+    np.subtract(d[1], d[3], out=t[3])
+
+    V = np.empty(d.shape, dtype=d.dtype)
+    np.subtract(t[:, 0], t[:, 2], out=V[:, 0])
+    np.add(t[:, 1], t[:, 2], out=V[:, 1])
+    np.subtract(t[:, 2], t[:, 1], out=V[:, 2])
+    np.subtract(t[:, 1], t[:, 3], out=V[:, 3])
+    return V
+
+
+def _input_transform_T(dV):
+    """V = B^T d B 的转置：dd = B dV B^T"""
+    t = np.empty(dV.shape, dtype=dV.dtype)
+    t[0] = dV[0]
+    np.subtract(dV[1], dV[2], out=t[1])
+    t[1] += dV[3]
+    np.add(dV[1], dV[2], out=t[2])
+    t[2] -= dV[0]
+    np.negative(dV[3], out=t[3])
+
+    dd = np.empty(dV.shape, dtype=dV.dtype)
+    dd[:, 0] = t[:, 0]
+    np.subtract(t[:, 1], t[:, 2], out=dd[:, 1])
+    dd[:, 1] += t[:, 3]
+    np.add(t[:, 1], t[:, 2], out=dd[:, 2])
+    dd[:, 2] -= t[:, 0]
+    np.negative(t[:, 3], out=dd[:, 3])
+    return dd
+
+
+def _output_transform(M):
+    """Y = A^T M A，M 的形状为 (4, 4, ...)，结果为 (2, 2, ...)"""
+    t = np.empty((2,) + M.shape[1:], dtype=M.dtype)
+    np.add(M[0], M[1], out=t[0])
+    t[0] += M[2]
+    np.subtract(M[1], M[2], out=t[1])
+    t[1] -= M[3]
+
+    Y = np.empty((2, 2) + M.shape[2:], dtype=M.dtype)
+    np.add(t[:, 0], t[:, 1], out=Y[:, 0])
+    Y[:, 0] += t[:, 2]
+    np.subtract(t[:, 1], t[:, 2], out=Y[:, 1])
+    Y[:, 1] -= t[:, 3]
+    return Y
+
+
+def _output_transform_T(dY):
+    """Y = A^T M A 的转置：dM = A dY A^T，dY 的形状为 (2, 2, ...)"""
+    t = np.empty((4,) + dY.shape[1:], dtype=dY.dtype)
+    t[0] = dY[0]
+    np.add(dY[0], dY[1], out=t[1])
+    np.subtract(dY[0], dY[1], out=t[2])
+    np.negative(dY[1], out=t[3])
+
+    dM = np.empty((4, 4) + dY.shape[2:], dtype=dY.dtype)
+    dM[:, 0] = t[:, 0]
+    np.add(t[:, 0], t[:, 1], out=dM[:, 1])
+    np.subtract(t[:, 0], t[:, 1], out=dM[:, 2])
+    np.negative(t[:, 1], out=dM[:, 3])
+    return dM
+
+
+def conv3x3_forward(x, U, b, pad=0):
+    """3x3、步幅 1 的卷积前向传播
+
+    Parameters
+    ----------
+    x : 输入 (N, C, H, W)
+    U : filter_transform 的结果 (16, FN, C)
+    b : 偏置 (FN,)
+    pad : 填充
+
+    Returns
+    -------
+    out : (N, FN, out_h, out_w)
+    V : 输入变换的结果 (16, C, N*th*tw)，反向传播时使用
+    """
+    N, C, H, W = x.shape
+    FN = U.shape[1]
+    out_h = H + 2*pad - 2
+    out_w = W + 2*pad - 2
+    th, tw = (out_h + 1) // 2, (out_w + 1) // 2
+
+    # 输出尺寸为奇数时在右下多补一行/列 0，使输出恰好是整数个 2x2 块
+    img = np.pad(x, [(0, 0), (0, 0), (pad, 2*th + 2 - H - pad), (pad, 2*tw + 2 - W - pad)],
+                 mode='constant')
+    V = _input_transform(_tile_view(img, th, tw)).reshape(16, C, -1)
+
+    M = np.matmul(U, V).reshape(4, 4, FN, N, th, tw)
+    Y = _output_transform(M)  # (2, 2, FN, N, th, tw)
+
+    out = Y.transpose(3, 2, 4, 0, 5, 1).reshape(N, FN, 2*th, 2*tw)
+    out = out[:, :, :out_h, :out_w] + b.reshape(1, FN, 1, 1)
+
+    return out, V
+
+
+def conv3x3_backward(dout, U, V, x_shape, pad=0, need_dx=True):
+    """3x3、步幅 1 的卷积反向传播（在变换域内求梯度）
+
+    Returns
+    -------
+    dx : (N, C, H, W)，need_dx为False时为None（不计算）
+    dW : (FN, C, 3, 3)
+    db : (FN,)
+    """
+    N, C, H, W = x_shape
+    FN = U.shape[1]
+    out_h, out_w = dout.shape[2:]
+    th, tw = (out_h + 1) // 2, (out_w + 1) // 2
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    dout = np.pad(dout, [(0, 0), (0, 0), (0, 2*th - out_h), (0, 2*tw - out_w)], mode='constant')
+    dY = dout.reshape(N, FN, th, 2, tw, 2).transpose(3, 5, 1, 0, 2, 4)  # (2, 2, FN, N, th, tw)
+    dM = _output_transform_T(dY).reshape(16, FN, -1)
+
+    # U = G g G^T  =>  dg = G^T dU G
+    dU = np.matmul(dM, V.transpose(0, 2, 1)).reshape(4, 4, FN, C)
+    g = G.astype(dU.dtype)
+    dW = np.einsum('ak,abfc,bl->fckl', g, dU, g)
+    if not need_dx:
+        return None, dW, db
+
+    dV = np.matmul(U.transpose(0, 2, 1), dM).reshape(4, 4, C, N, th, tw)
+    dd = _input_transform_T(dV)
+
+    # 4x4 的输入块之间相互重叠（步长 2），累加回图像
+    dimg = np.zeros((N, C, 2*th + 2, 2*tw + 2), dtype=dd.dtype)
+    for k in range(4):
+        for l in range(4):
+            dimg[:, :, k:k + 2*th:2, l:l + 2*tw:2] += dd[k, l].transpose(1, 0, 2, 3)
+
+    dx = dimg[:, :, pad:H + pad, pad:W + pad]
+
+    return dx, dW, db
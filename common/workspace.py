@@ -0,0 +1,106 @@
+# coding: utf-8
+"""im2col/col2im 等计算用的缓冲区池（workspace）
+
+训练时每次迭代的形状都相同，im2col 的 col、反向传播的 dcol、dmax、dx 等
+几十 MB 的缓冲区如果每次都新分配，分配和首次写入（缺页）的开销不可忽视。
+Workspace 按 (shape, dtype) 保存用完归还的数组，下次借用相同形状时直接复用。
+
+    ws = get_workspace()
+    buf = ws.borrow((N, C), np.float32)   # 内容未初始化
+    ...
+    ws.give_back(buf)                     # 归还后调用方不能再使用buf
+
+借出中的数组（例如各卷积层为反向传播保留的col）与池中空闲数组的总字节数不超过 max_bytes，
+超过时丢弃最久未使用的空闲数组（LRU），所以workspace占用的内存不会比不使用时多出 max_bytes 以上。
+借出的数组被调用方直接丢弃（不归还）时不再计入。
+稳定训练时 allocations 计数不再增加，可以用 stats() 确认。
+"""
+from collections import OrderedDict
+import weakref
+import numpy as np
+
+
+class Workspace:
+    """按 (shape, dtype) 复用缓冲区的池
+
+    Parameters
+    ----------
+    max_bytes : 借出中的数组与池中空闲数组的字节数之和的上限（0 表示不保留，相当于不使用workspace）
+    """
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self._free = OrderedDict()  # id(arr) -> arr，按最近归还的顺序排列（末尾最新）
+        self._lent = weakref.WeakValueDictionary()  # id(arr) -> arr，借出中的数组（被丢弃后自动删除）
+        self.pooled_bytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.allocations = 0  # 池中没有可用数组，新分配的次数
+        self.reuses = 0       # 从池中复用的次数
+        self.evictions = 0    # 超过上限而被丢弃的空闲数组的个数
+        self.overflows = 0    # 单个数组超过上限、归还时没有放入池中的次数
+
+    def stats(self):
+        return {'allocations': self.allocations, 'reuses': self.reuses,
+                'evictions': self.evictions, 'overflows': self.overflows,
+                'pooled_bytes': self.pooled_bytes, 'lent_bytes': self.lent_bytes()}
+
+    def lent_bytes(self):
+        """借出中（还没有归还、也没有被丢弃）的数组的字节数"""
+        return sum(arr.nbytes for arr in list(self._lent.values()))
+
+    def borrow(self, shape, dtype=np.float64):
+        """借用形状为shape的C连续数组（内容未初始化）"""
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        for key in reversed(self._free):
+            arr = self._free[key]
+            if arr.shape == shape and arr.dtype == dtype:
+                del self._free[key]
+                self.pooled_bytes -= arr.nbytes
+                self.reuses += 1
+                self._lent[id(arr)] = arr
+                return arr
+
+        self.allocations += 1
+        arr = np.empty(shape, dtype=dtype)
+        self._lent[id(arr)] = arr
+        return arr
+
+    def give_back(self, arr):
+        """归还borrow得到的数组，None或其他数组的视图（例如1x1卷积时作为col的输入）则什么也不做"""
+        if arr is None or not arr.flags.owndata or id(arr) in self._free:
+            return
+        if self._lent.get(id(arr)) is arr:
+            del self._lent[id(arr)]
+        if arr.nbytes > self.max_bytes:
+            self.overflows += 1
+            return
+
+        self._free[id(arr)] = arr
+        self.pooled_bytes += arr.nbytes
+        limit = self.max_bytes - self.lent_bytes()
+        while self._free and self.pooled_bytes > limit:
+            _, old = self._free.popitem(last=False)
+            self.pooled_bytes -= old.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        """丢弃池中所有的空闲数组"""
+        self._free.clear()
+        self.pooled_bytes = 0
+
+
+_workspace = Workspace()
+
+
+def get_workspace():
+    """各层共用的workspace"""
+    return _workspace
+
+
+def set_workspace(workspace):
+    """替换各层共用的workspace，返回原来的workspace"""
+    global _workspace
+    old, _workspace = _workspace, workspace
+    return old